@@ -17,7 +17,7 @@ router = APIRouter(
 
 
 @router.get("/{guildId}", response_model=AlertsSettings)
-async def read_mappings(guildId: str):
+def read_mappings(guildId: str):
     output_data = data.get_alerts_settings(guildId)
     if not output_data:
         return {GUILD_ID_KEY: guildId}
@@ -29,9 +29,10 @@ async def read_mappings(guildId: str):
 
 
 @router.post("", response_model=AlertsSettings)
-async def add_mappings(mapping: AlertsSettings, guildId: str):
+def add_mappings(mapping: AlertsSettings, guildId: str):
     if mapping.settings:
         data.set_alerts_settings(guildId, json.dumps(mapping.settings))
+        data.notify_change(ALERT_SETTINGS_TABLE, guildId)
 
     output_data = data.get_alerts_settings(guildId)
     if not output_data:
@@ -18,7 +18,7 @@ router = APIRouter(
 
 
 @router.get("/{guildId}", response_model=BotActivityMapping)
-async def read_mapping(guildId: str):
+def read_mapping(guildId: str):
     bot_instance = data.get_bot_instance(guildId)
     if not bot_instance:
         return {}
@@ -30,7 +30,7 @@ async def read_mapping(guildId: str):
 
 
 @router.post("", response_model=BotActivityMapping)
-async def add_mapping(mapping: BotActivityMapping, guildId: str):
+def add_mapping(mapping: BotActivityMapping, guildId: str):
     bot_instance = data.get_bot_instance(guildId)
 
     if not bot_instance:
@@ -17,7 +17,7 @@ router = APIRouter(
 
 
 @router.get("/{guildId}")
-async def read_mapping(guildId: str):
+def read_mapping(guildId: str):
     bot_instance = data.get_bot_instance(int(guildId))
 
     if not bot_instance:
@@ -37,7 +37,7 @@ async def read_mapping(guildId: str):
 
 
 @router.post("/", response_model=BotInstanceMapping)
-async def add_mapping(mapping: BotInstanceMapping, guildId: str):
+def add_mapping(mapping: BotInstanceMapping, guildId: str):
     if mapping.bot_instance is not None:
         data.add_bot_instance(guildId, mapping.bot_instance)
 
@@ -67,7 +67,7 @@ async def add_mapping(mapping: BotInstanceMapping, guildId: str):
 
 
 @router.delete("/")
-async def delete_mapping(guildId: str):
+def delete_mapping(guildId: str):
     bot_instance = data.get_bot_instance(guildId)
 
     if not bot_instance:
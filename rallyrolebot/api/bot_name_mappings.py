@@ -18,7 +18,7 @@ router = APIRouter(
 
 
 @router.get("/{guildId}", response_model=BotNameMapping)
-async def read_mapping(guildId: str):
+def read_mapping(guildId: str):
     bot_instance = data.get_bot_instance(guildId)
     if not bot_instance:
         return {"guildId": guildId, "bot_name": "rallybot"}
@@ -27,7 +27,7 @@ async def read_mapping(guildId: str):
 
 
 @router.post("/", response_model=BotNameMapping)
-async def add_mapping(mapping: BotNameMapping, guildId: str):
+def add_mapping(mapping: BotNameMapping, guildId: str):
     bot_instance = data.get_bot_instance(guildId)
     if not bot_instance:
         raise HTTPException(status_code=404, detail="Bot config not found")
@@ -4,6 +4,7 @@ from typing import List
 from fastapi import APIRouter, Depends
 from .dependencies import owner_or_admin
 from .models import ChannelMapping
+from constants import *
 
 import config
 config.parse_args()
@@ -16,18 +17,27 @@ router = APIRouter(
 
 
 @router.get("/{guildId}", response_model=List[ChannelMapping])
-async def read_mappings(guildId: str):
+def read_mappings(guildId: str):
     return [mappings for mappings in data.get_channel_mappings(guildId)]
 
 
 @router.post("", response_model=List[ChannelMapping])
-async def add_mappings(mapping: ChannelMapping, guildId: str):
+def add_mappings(mapping: ChannelMapping, guildId: str):
     data.add_channel_coin_mapping(
         guildId,
         mapping.coinKind,
         mapping.requiredBalance,
         mapping.channel,
     )
+    data.notify_change(CHANNEL_MAPPINGS_TABLE, guildId)
+    task = {
+        'kwargs': {
+            'guild_id': int(guildId),
+            'scope': UPDATE_SCOPE_CHANNELS,
+        },
+        'function': 'refresh_guild'
+    }
+    data.add_task(task)
     return [mappings for mappings in data.get_channel_mappings(guildId)]
 
 
@@ -35,11 +45,20 @@ async def add_mappings(mapping: ChannelMapping, guildId: str):
     "",
     response_model=List[ChannelMapping],
 )
-async def delete_mappings(mapping: ChannelMapping, guildId: str):
+def delete_mappings(mapping: ChannelMapping, guildId: str):
     data.remove_channel_mapping(
         guildId,
         mapping.coinKind,
         mapping.requiredBalance,
         mapping.channel,
     )
+    data.notify_change(CHANNEL_MAPPINGS_TABLE, guildId)
+    task = {
+        'kwargs': {
+            'guild_id': int(guildId),
+            'scope': UPDATE_SCOPE_CHANNELS,
+        },
+        'function': 'refresh_guild'
+    }
+    data.add_task(task)
     return [mappings for mappings in data.get_channel_mappings(guildId)]
\ No newline at end of file
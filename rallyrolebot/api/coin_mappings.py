@@ -3,6 +3,7 @@ import data
 from fastapi import APIRouter, Depends, HTTPException
 from .dependencies import owner_or_admin
 from .models import CoinMapping
+from constants import *
 
 import config
 config.parse_args()
@@ -16,7 +17,7 @@ router = APIRouter(
 
 
 @router.get("/{guildId}", response_model=CoinMapping)
-async def read_mapping(guildId: str):
+def read_mapping(guildId: str):
     coinKind = data.get_default_coin(guildId)
     if not coinKind:
         raise HTTPException(status_code=404, detail="Coin not found")
@@ -24,8 +25,9 @@ async def read_mapping(guildId: str):
 
 
 @router.post("", response_model=CoinMapping)
-async def add_mapping(mapping: CoinMapping, guildId: str):
+def add_mapping(mapping: CoinMapping, guildId: str):
     data.add_default_coin(guildId, mapping.coinKind)
+    data.notify_change(DEFAULT_COIN_TABLE, guildId)
     coinKind = data.get_default_coin(guildId)
     if not coinKind:
         raise HTTPException(status_code=404, detail="Coin not found")
@@ -11,5 +11,5 @@ router = APIRouter()
 
 
 @router.get("/commands", tags=["commands"], response_model=List[Command])
-async def read_commands():
+def read_commands():
     return [command for command in data.get_all_commands()]
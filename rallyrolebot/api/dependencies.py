@@ -44,7 +44,7 @@ def owner_or_admin_guilds(authorization):
     return guilds
 
 
-async def owner_or_admin(guildId: str, authorization: str = Header(...)):
+def owner_or_admin(guildId: str, authorization: str = Header(...)):
     guilds = owner_or_admin_guilds(authorization)
     if not guilds or guildId not in guilds:
         raise HTTPException(status_code=400, detail="you cannot access this record")
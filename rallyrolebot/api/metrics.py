@@ -0,0 +1,13 @@
+import data
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    # written by the bot at the end of every update sweep
+    return data.get_sweep_metrics() or ""
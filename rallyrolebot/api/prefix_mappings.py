@@ -3,6 +3,7 @@ import data
 from fastapi import APIRouter, Depends, HTTPException
 from .dependencies import owner_or_admin
 from .models import PrefixMapping
+from constants import *
 
 import config
 config.parse_args()
@@ -17,7 +18,7 @@ router = APIRouter(
 
 
 @router.get("/{guildId}", response_model=PrefixMapping)
-async def read_mapping(guildId: str):
+def read_mapping(guildId: str):
     prefix = data.get_prefix(guildId)
     if not prefix:
         raise HTTPException(status_code=404, detail="Prefix not found")
@@ -25,8 +26,9 @@ async def read_mapping(guildId: str):
 
 
 @router.post("", response_model=PrefixMapping)
-async def add_mapping(mapping: PrefixMapping, guildId: str):
+def add_mapping(mapping: PrefixMapping, guildId: str):
     data.add_prefix_mapping(guildId, mapping.prefix)
+    data.notify_change(CHANNEL_PREFIXES_TABLE, guildId)
     prefix = data.get_prefix(guildId)
     if not prefix:
         raise HTTPException(status_code=404, detail="Prefix not found")
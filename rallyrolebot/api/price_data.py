@@ -10,7 +10,7 @@ router = APIRouter(prefix="/coins", tags=["coins"])
 
 
 @router.get("/{coin}/price", response_model=CoinPrice)
-async def read_price(coin: str, include_24hr_change: Optional[bool] = False):
+def read_price(coin: str, include_24hr_change: Optional[bool] = False):
     price = rally_api.get_current_price(coin)
     if not include_24hr_change:
         return {"coinKind": coin, "priceInUSD": price["priceInUSD"]}
@@ -27,7 +27,7 @@ async def read_price(coin: str, include_24hr_change: Optional[bool] = False):
 
 
 @router.get("/{coin}/historical_price", response_model=List[CoinPrices])
-async def read_prices(
+def read_prices(
     coin: str,
     limit: Optional[int] = Query(
         None,
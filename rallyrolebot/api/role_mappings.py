@@ -4,6 +4,7 @@ from typing import List
 from fastapi import APIRouter, Depends
 from .dependencies import owner_or_admin
 from .models import RoleMapping
+from constants import *
 
 import config
 config.parse_args()
@@ -16,27 +17,45 @@ router = APIRouter(
 
 
 @router.get("/{guildId}", response_model=List[RoleMapping])
-async def read_mappings(guildId: str):
+def read_mappings(guildId: str):
     return [mappings for mappings in data.get_role_mappings(guildId)]
 
 
 @router.post("", response_model=List[RoleMapping])
-async def add_mapping(mapping: RoleMapping, guildId: str):
+def add_mapping(mapping: RoleMapping, guildId: str):
     data.add_role_coin_mapping(
         guildId,
         mapping.coinKind,
         mapping.requiredBalance,
         mapping.roleName,
     )
+    data.notify_change(ROLE_MAPPINGS_TABLE, guildId)
+    task = {
+        'kwargs': {
+            'guild_id': int(guildId),
+            'scope': UPDATE_SCOPE_ROLES,
+        },
+        'function': 'refresh_guild'
+    }
+    data.add_task(task)
     return [mappings for mappings in data.get_role_mappings(guildId)]
 
 
 @router.delete("", response_model=List[RoleMapping])
-async def delete_mapping(mapping: RoleMapping, guildId: str):
+def delete_mapping(mapping: RoleMapping, guildId: str):
     data.remove_role_mapping(
         guildId,
         mapping.coinKind,
         mapping.requiredBalance,
         mapping.roleName,
     )
+    data.notify_change(ROLE_MAPPINGS_TABLE, guildId)
+    task = {
+        'kwargs': {
+            'guild_id': int(guildId),
+            'scope': UPDATE_SCOPE_ROLES,
+        },
+        'function': 'refresh_guild'
+    }
+    data.add_task(task)
     return [mappings for mappings in data.get_role_mappings(guildId)]
\ No newline at end of file
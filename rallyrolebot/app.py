@@ -3,6 +3,7 @@ import uvicorn
 import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from utils import price_retention
 from utils.tasks import repeat_every
 from api import (
     channel_mappings,
@@ -16,7 +17,8 @@ from api import (
     bot_instance_mappings,
     bot_name_mappings,
     bot_activity_mappings,
-    webhooks_mapping
+    webhooks_mapping,
+    metrics,
 )
 
 import config
@@ -54,6 +56,7 @@ app.include_router(bot_avatar_mappings.router)
 app.include_router(bot_activity_mappings.router)
 app.include_router(alerts_settings_mappings.router)
 app.include_router(webhooks_mapping.router)
+app.include_router(metrics.router)
 
 
 @app.get("/")
@@ -64,6 +67,11 @@ async def root():
     }
 
 
+@app.on_event("startup")
+def migrate():
+    data.migrate()
+
+
 @app.on_event("startup")
 @repeat_every(seconds=60 * 60, logger=logger)
 def get_prices():
@@ -75,12 +83,16 @@ def get_prices():
             data.add_coin_price(str(price["priceInUSD"]), symbol)
         except:
             print(f"Failed to get price for {coin['coinSymbol']}")
-    count = data.price_count()
-    cache_max = int(config.CONFIG.cache_max)
-    print(f"Price cache updated, Count: {count}, Max: {cache_max}")
-    if count > cache_max:
-        data.clean_price_cache(count - cache_max)
-        print(f"{count - cache_max} cache entries removed")
+    print("Price cache updated")
+
+
+@app.on_event("startup")
+@repeat_every(seconds=PRICE_RETENTION_INTERVAL, logger=logger)
+def prune_prices():
+    removed, duration = price_retention.prune_coin_prices(
+        float(config.CONFIG.price_retention_days)
+    )
+    print(f"Price retention removed {removed} rows in {round(duration, 2)}s")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,520 @@
+"""
+Offline benchmark of the role and channel update.
+
+Builds a synthetic guild with members, roles, channels and mappings, serves balances
+from a local fake Rally server and replaces Discord with in-process stand-ins, then
+reports wall time, calls issued and peak memory of:
+
+    sweep        a full UpdateTask.update that has to fix everyone's roles and permissions
+    resweep      the next sweep, with nothing left to change
+    grant_role   grant_deny_role_to_member for every linked member
+    grant_chan   grant_deny_channel_to_member for every linked member
+    eval_py      finding the members whose mapped roles change, one member at a time
+    eval_np      the same with the numpy evaluation, when numpy is installed
+
+Usage, from the rallyrolebot directory:
+
+    python benchmark.py --members 1000 10000 100000 --rally_latency 20 --discord_latency 5
+"""
+import asyncio
+import functools
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from collections import Counter
+
+import config
+
+config.arg_parser.add(
+    "--members",
+    type=int,
+    nargs="+",
+    default=[1000, 10000, 100000],
+    help="Guild sizes to benchmark",
+)
+config.arg_parser.add(
+    "--linked", type=float, default=0.5, help="Share of members with a rally id"
+)
+config.arg_parser.add(
+    "--role_mappings", type=int, default=10, help="Role mappings in the guild"
+)
+config.arg_parser.add(
+    "--channel_mappings", type=int, default=3, help="Channel mappings in the guild"
+)
+config.arg_parser.add(
+    "--coins", type=int, default=3, help="Coins the mappings are spread over"
+)
+config.arg_parser.add(
+    "--rally_latency", type=float, default=20, help="Fake rally latency in milliseconds"
+)
+config.arg_parser.add(
+    "--discord_latency",
+    type=float,
+    default=5,
+    help="Fake discord latency in milliseconds",
+)
+config.arg_parser.add(
+    "--discord_rate",
+    type=float,
+    default=1000000,
+    help="Discord writes per second allowed by the action queue per guild and route",
+)
+config.arg_parser.add("--seed", type=int, default=0, help="Random seed")
+config.arg_parser.set_defaults(
+    database_connection="sqlite:///"
+    + os.path.join(tempfile.gettempdir(), "rallyrolebot_benchmark.db")
+)
+config.parse_args()
+
+import discord
+import main
+
+from aiohttp import web
+
+import rally_api
+
+from cogs import update_cog
+from constants import *
+from utils import action_queue as action_queue_module
+from utils.ext import connect_db, insert_many
+from utils.guild_index import GuildIndex
+from utils.metrics import sweep_metrics
+from utils.thresholds import numpy, parse_balances
+
+
+class DiscordCalls:
+    """Stands in for the discord http layer, counts the requests the bot makes."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = Counter()
+
+    async def request(self, route):
+        self.calls[route] += 1
+        await asyncio.sleep(self.latency)
+
+
+@functools.total_ordering
+class FakeRole:
+    def __init__(self, role_id, name, position, managed=False):
+        self.id = role_id
+        self.name = name
+        self.position = position
+        self.managed = managed
+
+    def __eq__(self, other):
+        return isinstance(other, FakeRole) and self.id == other.id
+
+    def __lt__(self, other):
+        return self.position < other.position
+
+    def __hash__(self):
+        return self.id
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMember:
+    def __init__(self, member_id, guild, roles, http):
+        self.id = member_id
+        self.guild = guild
+        self.roles = roles
+        self.top_role = roles[-1]
+        self._http = http
+
+    async def edit(self, roles):
+        await self._http.request("member_edit")
+        self.roles = [self.guild.default_role] + sorted(roles)
+
+    def __hash__(self):
+        return self.id
+
+    def __eq__(self, other):
+        return isinstance(other, FakeMember) and self.id == other.id
+
+    def __str__(self):
+        return f"member-{self.id}"
+
+
+class FakeChannel:
+    def __init__(self, channel_id, name, guild, http):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.overwrites = {}
+        self._http = http
+
+    def overwrites_for(self, target):
+        overwrite = self.overwrites.get(target)
+        if overwrite is None:
+            return discord.PermissionOverwrite()
+        return discord.PermissionOverwrite(**dict(overwrite))
+
+    async def set_permissions(self, target, overwrite):
+        await self._http.request("channel_set_permissions")
+        self.overwrites[target] = overwrite
+
+    async def edit(self, overwrites):
+        await self._http.request("channel_edit")
+        self.overwrites = dict(overwrites)
+
+    def __str__(self):
+        return self.name
+
+
+class FakeGuild:
+    def __init__(self, guild_id, http):
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+        self.chunked = True
+        self.default_role = FakeRole(guild_id, "@everyone", 0)
+        self.roles = [self.default_role]
+        self.channels = []
+        self._members = {}
+        self._http = http
+
+        bot_role = FakeRole(guild_id + 1, "bot", 1000)
+        self.roles.append(bot_role)
+        self.me = FakeMember(0, self, [self.default_role, bot_role], http)
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    def get_member(self, member_id):
+        return self._members.get(member_id)
+
+    def add_member(self, member_id):
+        member = FakeMember(member_id, self, [self.default_role], self._http)
+        self._members[member_id] = member
+        return member
+
+    async def chunk(self):
+        await self._http.request("chunk")
+        self.chunked = True
+
+    def __str__(self):
+        return self.name
+
+
+class FakeBot:
+    def __init__(self, guilds):
+        self.guilds = guilds
+        self.user = FakeMember(0, None, [None], None)
+        self.cogs = {}
+
+    async def wait_until_ready(self):
+        pass
+
+    def get_guild(self, guild_id):
+        for guild in self.guilds:
+            if guild.id == guild_id:
+                return guild
+        return None
+
+    def get_cog(self, name):
+        return self.cogs.get(name)
+
+
+class FakeRally:
+    """Local rally api serving deterministic balances with a fixed latency."""
+
+    def __init__(self, latency, coins, seed):
+        self.latency = latency
+        self.coins = coins
+        self.seed = seed
+        self.requests = 0
+        self.runner = None
+
+    def balances(self, rally_id):
+        rng = random.Random(f"{self.seed}-{rally_id}")
+        return [
+            {COIN_KIND_KEY: coin, COIN_BALANCE_KEY: str(rng.uniform(0, 100))}
+            for coin in self.coins
+        ]
+
+    async def handle_balance(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return web.json_response(self.balances(request.match_info["rally_id"]))
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/users/rally/{rally_id}/balance", self.handle_balance)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", 0).start()
+        host, port = self.runner.addresses[0][:2]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+@connect_db
+def seed_database(db, guild_id, connections, role_mappings, channel_mappings):
+    for table in (
+        RALLY_CONNECTIONS_TABLE,
+        ROLE_MAPPINGS_TABLE,
+        CHANNEL_MAPPINGS_TABLE,
+        BALANCE_SNAPSHOTS_TABLE,
+    ):
+        db[table].delete()
+
+    insert_many(
+        db,
+        db[RALLY_CONNECTIONS_TABLE],
+        [
+            {DISCORD_ID_KEY: discord_id, RALLY_ID_KEY: rally_id}
+            for discord_id, rally_id in connections.items()
+        ],
+    )
+    insert_many(
+        db,
+        db[ROLE_MAPPINGS_TABLE],
+        [
+            {
+                GUILD_ID_KEY: guild_id,
+                COIN_KIND_KEY: coin,
+                REQUIRED_BALANCE_KEY: required,
+                ROLE_NAME_KEY: name,
+            }
+            for coin, required, name in role_mappings
+        ],
+    )
+    insert_many(
+        db,
+        db[CHANNEL_MAPPINGS_TABLE],
+        [
+            {
+                GUILD_ID_KEY: guild_id,
+                COIN_KIND_KEY: coin,
+                REQUIRED_BALANCE_KEY: required,
+                CHANNEL_NAME_KEY: name,
+            }
+            for coin, required, name in channel_mappings
+        ],
+    )
+
+
+def build_guild(size, options, http, coins):
+    """
+    Build a guild of size members and store its mappings and rally connections.
+
+    Returns
+    _______
+
+      (guild, connections, role_mappings, channel_mappings)
+
+    """
+    rng = random.Random(options.seed)
+    guild = FakeGuild(10 ** 6, http)
+
+    role_mappings = []
+    for i in range(options.role_mappings):
+        role = FakeRole(guild.id + 10 + i, f"role-{i}", 10 + i)
+        guild.roles.append(role)
+        role_mappings.append((coins[i % len(coins)], rng.randint(1, 90), role.name))
+
+    channel_mappings = []
+    for i in range(options.channel_mappings):
+        channel = FakeChannel(guild.id + 1000 + i, f"channel-{i}", guild, http)
+        guild.channels.append(channel)
+        channel_mappings.append(
+            (coins[i % len(coins)], rng.randint(1, 90), channel.name)
+        )
+
+    connections = {}
+    for member_id in range(1, size + 1):
+        guild.add_member(member_id)
+        if rng.random() < options.linked:
+            connections[member_id] = f"rally-{member_id}"
+
+    seed_database(guild.id, connections, role_mappings, channel_mappings)
+    return guild, connections, role_mappings, channel_mappings
+
+
+async def measure(name, size, coroutine, http, rally):
+    """Run a benchmark step and return its row of the report."""
+    rally_api.balance_cache = rally_api.BalanceCache()
+    http.calls.clear()
+    rally.requests = 0
+    db_calls, _ = sweep_metrics.totals(METRICS_SERVICE_DB)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    await coroutine
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "step": name,
+        "members": size,
+        "seconds": elapsed,
+        "rally": rally.requests,
+        "discord": sum(http.calls.values()),
+        "db": sweep_metrics.totals(METRICS_SERVICE_DB)[0] - db_calls,
+        "peak_mb": peak / 2 ** 20,
+    }
+
+
+async def grant_to_all(grant, mapping, guild, connections):
+    guild_index = GuildIndex(guild)
+    for discord_id, rally_id in connections.items():
+        balances = await rally_api.balance_cache.get(rally_id)
+        await grant(mapping, guild.get_member(discord_id), balances, guild_index)
+
+
+async def evaluate_per_member(role_index, members, amounts_list):
+    return [
+        member
+        for member, amounts in zip(members, amounts_list)
+        if update_cog.get_target_roles(member, role_index, amounts)
+        != set(member.roles[1:])
+    ]
+
+
+async def evaluate_vectorized(role_index, members, amounts_list):
+    changes = role_index.changes(amounts_list, [member.roles for member in members])
+    return [members[row] for row in changes]
+
+
+async def benchmark_evaluation(size, guild, http, rally):
+    """Compare the per member and the numpy evaluation of the guild's role mappings."""
+    role_index, _ = await update_cog.compile_guild_mappings(guild)
+    members = guild.members
+    amounts_list = [
+        parse_balances(rally.balances(f"rally-{member.id}")) for member in members
+    ]
+
+    rows = [
+        await measure(
+            "eval_py",
+            size,
+            evaluate_per_member(role_index, members, amounts_list),
+            http,
+            rally,
+        )
+    ]
+    if numpy is not None:
+        rows.append(
+            await measure(
+                "eval_np",
+                size,
+                evaluate_vectorized(role_index, members, amounts_list),
+                http,
+                rally,
+            )
+        )
+    return rows
+
+
+async def benchmark_size(size, options, rally, coins):
+    http = DiscordCalls(options.discord_latency / 1000)
+    guild, connections, role_mappings, channel_mappings = build_guild(
+        size, options, http, coins
+    )
+    bot = FakeBot([guild])
+    main.main_bot = bot
+    main.running_bots = {bot.user.id: {"bot": bot}}
+    cog = update_cog.UpdateTask(bot)
+    cog.engine = update_cog.UpdateEngine()
+    bot.cogs["UpdateTask"] = cog
+
+    rows = [await measure("sweep", size, cog.update(), http, rally)]
+    # make the guild due again right away
+    cog.engine.cadence.last_update.clear()
+    rows.append(await measure("resweep", size, cog.update(), http, rally))
+
+    # start the one time mappings from a guild without roles or overwrites
+    for member in guild.members:
+        member.roles = [guild.default_role]
+    for channel in guild.channels:
+        channel.overwrites = {}
+
+    coin, required, name = role_mappings[0]
+    role_mapping = {
+        GUILD_ID_KEY: guild.id,
+        COIN_KIND_KEY: coin,
+        REQUIRED_BALANCE_KEY: required,
+        ROLE_NAME_KEY: name,
+    }
+    rows.append(
+        await measure(
+            "grant_role",
+            size,
+            grant_to_all(
+                update_cog.grant_deny_role_to_member, role_mapping, guild, connections
+            ),
+            http,
+            rally,
+        )
+    )
+
+    if channel_mappings:
+        coin, required, name = channel_mappings[0]
+        channel_mapping = {
+            GUILD_ID_KEY: guild.id,
+            COIN_KIND_KEY: coin,
+            REQUIRED_BALANCE_KEY: required,
+            CHANNEL_NAME_KEY: name,
+        }
+        rows.append(
+            await measure(
+                "grant_chan",
+                size,
+                grant_to_all(
+                    update_cog.grant_deny_channel_to_member,
+                    channel_mapping,
+                    guild,
+                    connections,
+                ),
+                http,
+                rally,
+            )
+        )
+
+    rows.extend(await benchmark_evaluation(size, guild, http, rally))
+    return rows
+
+
+def print_report(rows):
+    header = f"{'step':<12}{'members':>10}{'seconds':>10}{'rally':>10}{'discord':>10}{'db':>8}{'peak MB':>10}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            f"{row['step']:<12}{row['members']:>10}{row['seconds']:>10.2f}"
+            f"{row['rally']:>10}{row['discord']:>10}{row['db']:>8}{row['peak_mb']:>10.1f}"
+        )
+
+
+async def run(options):
+    coins = [f"COIN{i}" for i in range(options.coins)]
+    rally = FakeRally(options.rally_latency / 1000, coins, options.seed)
+    rally_api.BASE_URL = await rally.start()
+
+    # only the fake discord latency should limit the writes
+    action_queue_module.ACTION_RATE_LIMITS = {
+        route: (options.discord_rate, options.discord_rate)
+        for route in ACTION_RATE_LIMITS
+    }
+
+    rows = []
+    try:
+        for size in options.members:
+            rows.extend(await benchmark_size(size, options, rally, coins))
+    finally:
+        await rally.stop()
+        await rally_api.close_session()
+
+    print_report(rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(config.CONFIG))
@@ -4,12 +4,12 @@ import discord
 import errors
 import data
 import validation
-import rally_api
 
 from discord.ext import commands
 from cogs import update_cog
 from main import RallyRoleBot
-from utils import pretty_print
+from utils import pretty_print, run_db
+from utils.guild_index import GuildIndex
 from constants import *
 
 
@@ -56,10 +56,14 @@ class ChannelCommands(commands.Cog):
     async def set_coin_for_channel(
         self, ctx, coin_name, coin_amount: int, channel: discord.TextChannel
     ):
-        data.add_channel_coin_mapping(
-            ctx.guild.id, coin_name, coin_amount, channel.name
+        await run_db(
+            data.add_channel_coin_mapping,
+            ctx.guild.id,
+            coin_name,
+            coin_amount,
+            channel.name,
         )
-        await update_cog.force_update(self.bot, ctx)
+        await update_cog.force_update(self.bot, ctx, UPDATE_SCOPE_CHANNELS)
 
     @commands.command(
         name="one_time_channel_mapping",
@@ -70,22 +74,20 @@ class ChannelCommands(commands.Cog):
     async def one_time_channel_mapping(
         self, ctx, coin_name, coin_amount: int, channel: discord.TextChannel
     ):
+        channel_mapping = {
+            data.GUILD_ID_KEY: ctx.guild.id,
+            data.COIN_KIND_KEY: coin_name,
+            data.REQUIRED_BALANCE_KEY: coin_amount,
+            data.CHANNEL_NAME_KEY: channel.name,
+        }
+        guild_index = GuildIndex(ctx.guild)
 
-        for member in ctx.guild.members:
-            rally_id = data.get_rally_id(member.id)
-            if rally_id:
-                balances = rally_api.get_balances(rally_id)
-                await update_cog.grant_deny_channel_to_member(
-                    {
-                        data.GUILD_ID_KEY: ctx.guild.id,
-                        data.COIN_KIND_KEY: coin_name,
-                        data.REQUIRED_BALANCE_KEY: coin_amount,
-                        data.CHANNEL_NAME_KEY: channel.name,
-                    },
-                    member,
-                    balances,
-                )
-        await update_cog.force_update(self.bot, ctx)
+        async def apply_mapping(member, balances):
+            return await update_cog.grant_deny_channel_to_member(
+                channel_mapping, member, balances, guild_index
+            )
+
+        update_cog.run_one_time_mapping(ctx, apply_mapping)
 
     @commands.command(
         name="unset_channel_mapping",
@@ -96,13 +98,18 @@ class ChannelCommands(commands.Cog):
     async def unset_coin_for_channel(
         self, ctx, coin_name, coin_amount: int, channel: discord.TextChannel
     ):
-        data.remove_channel_mapping(ctx.guild.id, coin_name, coin_amount, channel.name)
+        await run_db(
+            data.remove_channel_mapping, ctx.guild.id, coin_name, coin_amount, channel.name
+        )
+        self.bot.get_cog("UpdateTask").queue_update(
+            ctx.guild.id, scope=UPDATE_SCOPE_CHANNELS
+        )
 
     @commands.command(name="get_channel_mappings", help="Get channel mappings")
     @validation.owner_or_permissions(administrator=True)
     async def get_channel_mappings(self, ctx):
         mappings_str = "```Channel   Coin   Amount\n\n"
-        for mapping in data.get_channel_mappings(ctx.guild.id):
+        for mapping in await run_db(data.get_channel_mappings, ctx.guild.id):
             mappings_str += f"{mapping[CHANNEL_NAME_KEY]}   {mapping[COIN_KIND_KEY]}   {mapping[REQUIRED_BALANCE_KEY]}\n"
         mappings_str += "```"
         await pretty_print(
@@ -115,12 +122,12 @@ class ChannelCommands(commands.Cog):
     @commands.command(name="set_purchase_message", help="Change the $purchase message")
     @validation.owner_or_permissions(administrator=True)
     async def set_purchase_message(self, ctx, *, message):
-        data.set_purchase_message(ctx.guild.id, message)
+        await run_db(data.set_purchase_message, ctx.guild.id, message)
 
     @commands.command(name="purchase", help="Learn how you can purchase")
     @commands.guild_only()
     async def purchase(self, ctx):
-        message = data.get_purchase_message(ctx.guild.id)
+        message = await run_db(data.get_purchase_message, ctx.guild.id)
         if message is not None:
             await ctx.send(message)
         else:
@@ -129,12 +136,12 @@ class ChannelCommands(commands.Cog):
     @commands.command(name="set_donate_message", help="Change the $donate message")
     @validation.owner_or_permissions(administrator=True)
     async def set_donate_message(self, ctx, *, message):
-        data.set_donate_message(ctx.guild.id, message)
+        await run_db(data.set_donate_message, ctx.guild.id, message)
 
     @commands.command(name="donate", help="Learn how you can donate")
     @commands.guild_only()
     async def donate(self, ctx):
-        message = data.get_donate_message(ctx.guild.id)
+        message = await run_db(data.get_donate_message, ctx.guild.id)
         if message is not None:
             await ctx.send(message)
         else:
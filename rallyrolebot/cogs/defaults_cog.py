@@ -14,8 +14,9 @@ import aiohttp
 
 from main import RallyRoleBot
 from constants import *
-from utils import pretty_print, alerts
+from utils import pretty_print, alerts, run_db
 from utils.converters import TimeframeType
+from utils.prefix_cache import prefix_cache
 
 
 class DefaultsCommands(commands.Cog):
@@ -38,7 +39,7 @@ class DefaultsCommands(commands.Cog):
     @staticmethod
     async def update_setting(ctx, alert, alert_nr, value, setting):
         # check if settings have been configured on the dashboard
-        settings = data.get_alerts_settings(ctx.guild.id)
+        settings = await run_db(data.get_alerts_settings, ctx.guild.id)
         if not settings:
             return await pretty_print(ctx, "Alert settings have not been configured on the dashboard", title='Error', color=ERROR_COLOR)
 
@@ -64,7 +65,7 @@ class DefaultsCommands(commands.Cog):
 
         # update settings
         instance['settings'][setting] = value
-        data.set_alerts_settings(ctx.guild.id, json.dumps(settings))
+        await run_db(data.set_alerts_settings, ctx.guild.id, json.dumps(settings))
 
         return await pretty_print(ctx, "Alert settings have been updated", title='Success', color=SUCCESS_COLOR)
 
@@ -99,10 +100,10 @@ class DefaultsCommands(commands.Cog):
     @commands.guild_only()
     async def allcoinstats(self, ctx, timeframe: TimeframeType):
         # delete week old data
-        data.delete_week_old_events()
+        await run_db(data.delete_week_old_events)
 
         # if default coin isn't set, send info to user about how to set it
-        default_coin = data.get_default_coin(ctx.guild.id)
+        default_coin = await run_db(data.get_default_coin, ctx.guild.id)
         if not default_coin:
             return await pretty_print(
                 ctx, "A default coin has not been set. An admin can set the default coin by typing $setdefaultcoin . Type $help for more information.", title="Error", color=ERROR_COLOR
@@ -110,9 +111,9 @@ class DefaultsCommands(commands.Cog):
 
         # get statistics
         if timeframe == 'day':
-            coin_stats = alerts.get_day_stats(default_coin)
+            coin_stats = await alerts.get_day_stats(default_coin)
         else:
-            coin_stats = alerts.get_week_stats(default_coin)
+            coin_stats = await alerts.get_week_stats(default_coin)
 
         rewards = rally_api.get_coin_rewards(default_coin)
         coin_image_url = rally_api.get_coin_image_url(default_coin)
@@ -122,11 +123,11 @@ class DefaultsCommands(commands.Cog):
         reward_str = 'last24HourEarned' if timeframe == 'day' else 'weeklyAccumulatedReward'
         message = {
             "description": f"```xl\n"
-                           f"- {extra_str}`s purchases: {len(coin_stats['buy'])}\n\n"
-                           f"- {extra_str}`s donations: {len(coin_stats['donate'])}\n\n"
-                           f"- {extra_str}`s transfers: {len(coin_stats['transfer'])}\n\n"
-                           f"- {extra_str}`s conversions: {len(coin_stats['convert'])}\n\n"
-                           f"- {extra_str}`s redeems: {len(coin_stats['redeem'])}\n\n"
+                           f"- {extra_str}`s purchases: {coin_stats['buy']['count']}\n\n"
+                           f"- {extra_str}`s donations: {coin_stats['donate']['count']}\n\n"
+                           f"- {extra_str}`s transfers: {coin_stats['transfer']['count']}\n\n"
+                           f"- {extra_str}`s conversions: {coin_stats['convert']['count']}\n\n"
+                           f"- {extra_str}`s redeems: {coin_stats['redeem']['count']}\n\n"
                            f"- {extra_str}`s rewards earned: {round(rewards[reward_str], 3)}\n"
                            f"```",
             "color": 0xff0000,
@@ -165,7 +166,7 @@ class DefaultsCommands(commands.Cog):
                 ctx, "Set default coin timed out 👎", title="Timeout", color=ERROR_COLOR
             )
         else:
-            data.add_default_coin(ctx.guild.id, coin_name)
+            await run_db(data.add_default_coin, ctx.guild.id, coin_name)
             await pretty_print(
                 ctx,
                 f"{coin_name} is now the default coin 👍",
@@ -179,7 +180,8 @@ class DefaultsCommands(commands.Cog):
     )
     @validation.owner_or_permissions(administrator=True)
     async def set_prefix(self, ctx, prefix):
-        data.add_prefix_mapping(ctx.guild.id, prefix)
+        await run_db(data.add_prefix_mapping, ctx.guild.id, prefix)
+        prefix_cache.set(ctx.guild.id, prefix)
 
     @commands.command(
         name="change_bot_name",
@@ -189,7 +191,7 @@ class DefaultsCommands(commands.Cog):
     async def set_bot_name(self, ctx, *, name=""):
         try:
             await self.bot.user.edit(username=name)
-            data.set_bot_name(ctx.guild.id, name)
+            await run_db(data.set_bot_name, ctx.guild.id, name)
         except Exception as e:
             return await ctx.send(f'Error: {e.text.split(":")[-1]}')
 
@@ -208,7 +210,7 @@ class DefaultsCommands(commands.Cog):
                     avatar = await response.read()
 
             await self.bot.user.edit(avatar=avatar)
-            data.set_bot_avatar(ctx.guild.id, url)
+            await run_db(data.set_bot_avatar, ctx.guild.id, url)
         except:
             return await ctx.send('Error setting new bot avatar')
 
@@ -236,7 +238,7 @@ class DefaultsCommands(commands.Cog):
     @validation.owner_or_permissions(administrator=True)
     async def list_all_users(self, ctx):
         users_str = ""
-        registered_users = data.get_all_users()
+        registered_users = await run_db(data.get_all_users)
         for user in registered_users:
             member = await ctx.guild.fetch_member(user[DISCORD_ID_KEY])
             if member:
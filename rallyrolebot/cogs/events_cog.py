@@ -9,7 +9,9 @@ import discord
 
 from cogs.update_cog import default_avatar, set_default_avatar
 from constants import *
-from utils import alerts
+from utils import alerts, run_db
+from utils.change_feed import change_feed
+from utils.task_queue import task_queue
 from discord.ext import commands
 from main import RallyRoleBot
 
@@ -26,18 +28,18 @@ class Events(commands.Cog):
         @param timer: timer object dict
         """
         # delete week old stats
-        data.delete_week_old_events()
+        await run_db(data.delete_week_old_events)
 
         # gather some needed data
         guild_id = timer['guildId']
         channel_name = timer['extras']['channel_name']
         webhook_url = await alerts.get_webhook_url(guild_id, channel_name)
-        default_coin = data.get_default_coin(int(guild_id))
+        default_coin = await run_db(data.get_default_coin, int(guild_id))
 
         # check if there is a webhook url to send stats to
         if webhook_url:
             # gather stats data
-            coin_day_stats = alerts.get_day_stats(default_coin)
+            coin_day_stats = await alerts.get_day_stats(default_coin)
             total_stats = rally_api.get_coin_summary(default_coin)
             rewards = rally_api.get_coin_rewards(default_coin)
 
@@ -49,11 +51,11 @@ class Events(commands.Cog):
                         "description": f"```xl\n- Total coins: {round(total_stats['totalCoins'], 3)}\n\n"
                                        f"- Total supporters: {round(total_stats['totalSupporters'], 3)}\n\n"
                                        f"- Total support volume: {round(total_stats['totalSupportVolume'], 3)} USD\n\n\n"
-                                       f"- Today`s purchases: {len(coin_day_stats['buy'])}\n\n"
-                                       f"- Today`s donations: {len(coin_day_stats['donate'])}\n\n"
-                                       f"- Today`s transfers: {len(coin_day_stats['transfer'])}\n\n"
-                                       f"- Today`s conversions: {len(coin_day_stats['convert'])}\n\n"
-                                       f"- Today`s redeems: {len(coin_day_stats['redeem'])}\n\n"
+                                       f"- Today`s purchases: {coin_day_stats['buy']['count']}\n\n"
+                                       f"- Today`s donations: {coin_day_stats['donate']['count']}\n\n"
+                                       f"- Today`s transfers: {coin_day_stats['transfer']['count']}\n\n"
+                                       f"- Today`s conversions: {coin_day_stats['convert']['count']}\n\n"
+                                       f"- Today`s redeems: {coin_day_stats['redeem']['count']}\n\n"
                                        f"- Today`s rewards earned: {round(rewards['last24HourEarned'], 3)}\n```",
                         "color": 0xff0000,
                         "author": {
@@ -85,7 +87,7 @@ class Events(commands.Cog):
         if time_midnight < round(time.time()):
             time_midnight = round(time.time()) + (24 * 3600)  # 24h
 
-        self.bot.timers.create(
+        await self.bot.timers.create(
             guild_id=guild_id,
             expires=time_midnight,
             event='daily_stats',
@@ -105,30 +107,42 @@ class Events(commands.Cog):
 
         # for instances
         if config.CONFIG.secret_token != self.bot.http.token:
-            bot_instance = data.get_bot_instance_token(self.bot.http.token)
+            bot_instance = await run_db(
+                data.get_bot_instance_token, self.bot.http.token
+            )
 
             # set presence
             if bot_instance[BOT_ACTIVITY_TEXT_KEY]:
                 await self.bot.change_presence(status=discord.Status.online, activity=main.running_bots[self.bot.user.id]['activity'])
 
             # set bot id
-            data.set_bot_id(self.bot.user.id, self.bot.http.token)
+            await run_db(data.set_bot_id, self.bot.user.id, self.bot.http.token)
             # set bot name
-            data.set_bot_name(bot_instance[GUILD_ID_KEY], self.bot.user.name)
+            await run_db(
+                data.set_bot_name, bot_instance[GUILD_ID_KEY], self.bot.user.name
+            )
 
         # for the main bot
         else:
             main.main_bot = self.bot
+            change_feed.start()
+            task_queue.start()
             await self.bot.run_bot_instances()
-            update_cog_object.run_tasks.start()
+
+            # the main bot's update loops update the guilds of every instance
+            for loop in (
+                update_cog_object.update,
+                update_cog_object.process_update_queue,
+            ):
+                if not loop.is_running():
+                    loop.start()
 
         print("We have logged in as {0.user}".format(self.bot))
-        update_cog_object.update.start()
 
         if not default_avatar:
             await set_default_avatar()
 
-        self.bot.timers.run_old()
+        await self.bot.timers.run_old()
 
 
 def setup(bot: RallyRoleBot):
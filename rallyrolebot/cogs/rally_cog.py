@@ -12,7 +12,7 @@ import errors
 
 from urllib.parse import urlencode
 
-from utils import pretty_print, gradient
+from utils import pretty_print, gradient, run_db
 from utils.converters import CreatorCoin, CommonCoin, CurrencyType
 from constants import *
 
@@ -38,7 +38,11 @@ class RallyCommands(commands.Cog):
     @commands.command(name="set_rally_id", help="Set your rally id")
     @commands.dm_only()
     async def set_rally_id(self, ctx, rally_id):
-        data.add_discord_rally_mapping(ctx.author.id, rally_id)
+        await run_db(data.add_discord_rally_mapping, ctx.author.id, rally_id)
+        rally_api.balance_cache.invalidate(rally_id)
+
+        # the update queue is shared by every bot instance, and covers all of their guilds
+        self.bot.get_cog("UpdateTask").queue_update(member_id=ctx.author.id)
 
     @commands.command(name="price", help="Get the price data of a coin")
     async def price(self, ctx, coin: Union[CreatorCoin, CommonCoin, dict]):
@@ -84,7 +88,7 @@ class RallyCommands(commands.Cog):
     @commands.command(name="unset_rally_id", help="Unset your rally id")
     @commands.dm_only()
     async def unset_rally_id(self, ctx, rally_id):
-        data.remove_discord_rally_mapping(ctx.author.id, rally_id)
+        await run_db(data.remove_discord_rally_mapping, ctx.author.id, rally_id)
 
     @commands.command(
         name="coinlink",
@@ -118,8 +122,10 @@ class RallyCommands(commands.Cog):
     @commands.dm_only()
     @validation.is_wallet_verified()
     async def balance(self, ctx):
-        rally_id = data.get_rally_id(ctx.message.author.id)
-        balances = rally_api.get_balances(rally_id)
+        rally_id = await run_db(data.get_rally_id, ctx.message.author.id)
+        balances = await rally_api.fetch_balances(rally_id)
+        if balances is None:
+            raise errors.RequestError("Could not fetch your balance, try again later")
 
         balance_str = ""
 
@@ -6,14 +6,15 @@ from discord.ext import commands
 from main import RallyRoleBot
 
 import data
-import rally_api
 import validation
 import errors
 
 from cogs import update_cog
 
 from constants import *
-from utils import pretty_print
+from utils import pretty_print, run_db
+from utils.guild_index import GuildIndex
+from utils.thresholds import ThresholdIndex, parse_balances
 
 
 class RoleCommands(commands.Cog):
@@ -42,8 +43,10 @@ class RoleCommands(commands.Cog):
     async def set_coin_for_role(
         self, ctx, coin_name, coin_amount: int, role: discord.Role
     ):
-        data.add_role_coin_mapping(ctx.guild.id, coin_name, coin_amount, role.name)
-        await update_cog.force_update(self.bot, ctx)
+        await run_db(
+            data.add_role_coin_mapping, ctx.guild.id, coin_name, coin_amount, role.name
+        )
+        await update_cog.force_update(self.bot, ctx, UPDATE_SCOPE_ROLES)
 
     @commands.command(
         name="one_time_role_mapping",
@@ -54,21 +57,31 @@ class RoleCommands(commands.Cog):
     async def one_time_role_mapping(
         self, ctx, coin_name, coin_amount: int, role: discord.Role
     ):
-        for member in ctx.guild.members:
-            rally_id = data.get_rally_id(member.id)
-            if rally_id:
-                balances = rally_api.get_balances(rally_id)
-                await update_cog.grant_deny_role_to_member(
+        role_index = ThresholdIndex(
+            GuildIndex(ctx.guild).resolve_role_mappings(
+                [
                     {
                         data.GUILD_ID_KEY: ctx.guild.id,
                         data.COIN_KIND_KEY: coin_name,
                         data.REQUIRED_BALANCE_KEY: coin_amount,
                         data.ROLE_NAME_KEY: role.name,
-                    },
-                    member,
-                    balances,
-                )
-        await update_cog.force_update(self.bot, ctx)
+                    }
+                ]
+            )
+        )
+        # resolving leaves out roles that are managed or not below the bot's top role
+        if not role_index:
+            raise errors.IllegalRole(
+                f"Can't manage the role '{role.name}', it has to be below the bot's "
+                "highest role and not managed by an integration"
+            )
+
+        async def apply_mapping(member, balances):
+            return await update_cog.reconcile_member_roles(
+                member, role_index, parse_balances(balances), ACTION_PRIORITY_USER
+            )
+
+        update_cog.run_one_time_mapping(ctx, apply_mapping)
 
     @commands.command(
         name="unset_role_mapping",
@@ -79,14 +92,28 @@ class RoleCommands(commands.Cog):
     async def unset_coin_for_role(
         self, ctx, coin_name, coin_amount: int, role: discord.Role
     ):
-        data.remove_role_mapping(ctx.guild.id, coin_name, coin_amount, role.name)
+        await run_db(
+            data.remove_role_mapping, ctx.guild.id, coin_name, coin_amount, role.name
+        )
+        self.bot.get_cog("UpdateTask").queue_update(
+            ctx.guild.id, scope=UPDATE_SCOPE_ROLES
+        )
+
+    @commands.command(
+        name="set_tiered_roles",
+        help=" <on/off> When on, only the highest role a member qualifies for is granted per coin",
+    )
+    @validation.owner_or_permissions(administrator=True)
+    async def set_tiered_roles(self, ctx, tiered: bool):
+        await run_db(data.set_tiered_roles, ctx.guild.id, tiered)
+        await update_cog.force_update(self.bot, ctx, UPDATE_SCOPE_ROLES)
 
     # TODO: this command might run the risk of not printing due to character limit
     @commands.command(name="get_role_mappings", help="Get role mappings")
     @validation.owner_or_permissions(administrator=True)
     async def get_role_mappings(self, ctx):
         mappings_str = "```Role   Coin   Amount\n\n"
-        for mapping in data.get_role_mappings(ctx.guild.id):
+        for mapping in await run_db(data.get_role_mappings, ctx.guild.id):
             mappings_str += f"{mapping[ROLE_NAME_KEY]}   {mapping[COIN_KIND_KEY]}   {mapping[REQUIRED_BALANCE_KEY]}\n"
         mappings_str += "```"
         await pretty_print(
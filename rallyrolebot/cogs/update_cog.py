@@ -1,23 +1,32 @@
 import sys
 import traceback
-import threading
 import discord
 import discord.utils
 import main
 
 from discord.ext import commands
 from discord.ext import tasks as discord_tasks
-from discord.utils import get
 from constants import *
-from utils import tasks
 import aiohttp
 
 import asyncio
 import errors
+import time
+
+from collections import Counter, defaultdict
 import data
 import rally_api
 import validation
-from utils import pretty_print
+from utils import pretty_print, run_db
+from utils.action_queue import action_queue
+from utils.cadence import GuildCadence
+from utils.chunk_tracker import ChunkTracker
+from utils.guild_index import GuildIndex
+from utils.metrics import sweep_metrics
+from utils.prefix_cache import prefix_cache
+from utils.task_queue import task_queue
+from utils.thresholds import ThresholdIndex, parse_balances, use_vectorized
+from utils.update_queue import UpdateItem, UpdateQueue
 
 default_avatar = ''
 
@@ -30,7 +39,151 @@ async def set_default_avatar():
             default_avatar = await response.read()
 
 
-async def grant_deny_channel_to_member(channel_mapping, member, balances):
+async def compile_guild_mappings(guild):
+    """
+    Load a guild's role and channel mappings and compile them into threshold indexes.
+
+    Parameters
+    __________
+
+      guild (discord.Guild) - The guild to compile the mappings of
+
+    Returns
+    _______
+
+      (role_index, channel_index) ThresholdIndex tuple
+
+    """
+    with sweep_metrics.db_call(guild.id):
+        role_mappings = await run_db(data.get_role_mappings, guild.id) or []
+    with sweep_metrics.db_call(guild.id):
+        channel_mappings = await run_db(data.get_channel_mappings, guild.id) or []
+    with sweep_metrics.db_call(guild.id):
+        tiered = bool(await run_db(data.get_tiered_roles, guild.id))
+
+    guild_index = GuildIndex(guild)
+    role_mappings = guild_index.resolve_role_mappings(role_mappings)
+    channel_mappings = guild_index.resolve_channel_mappings(channel_mappings)
+    return ThresholdIndex(role_mappings, tiered=tiered), ThresholdIndex(channel_mappings)
+
+
+def get_target_overwrite(channel, member, allowed):
+    """
+    Compute the permission overwrite a member should have on a mapped channel.
+
+    Parameters
+    __________
+
+      channel (discord.abc.GuildChannel) - The channel the mapping points to
+      member (discord.Member) - The discord member to check
+      allowed (bool) - Whether the member holds enough of the coin to access the channel
+
+    Returns
+    _______
+
+      The new discord.PermissionOverwrite, or None if the member's current overwrite is already correct
+
+    """
+    current = channel.overwrites_for(member)
+    target = discord.PermissionOverwrite(**dict(current))
+    target.update(
+        send_messages=allowed, read_messages=allowed, read_message_history=allowed
+    )
+    if target == current:
+        return None
+    return target
+
+
+async def set_member_overwrite(channel, member, overwrite, priority):
+    await action_queue.run(
+        channel.guild.id,
+        ACTION_ROUTE_CHANNEL_PERMISSIONS,
+        (channel.id, member.id),
+        lambda: channel.set_permissions(member, overwrite=overwrite),
+        priority,
+    )
+
+
+async def apply_channel_overwrites(channel, changed_overwrites, priority=ACTION_PRIORITY_SWEEP):
+    """
+    Write changed member overwrites to a channel.
+
+    A few changes are written one member at a time, once there are
+    CHANNEL_BULK_OVERWRITE_THRESHOLD or more of them all overwrites of the
+    channel are replaced with a single channel edit.
+
+    Parameters
+    __________
+
+      channel (discord.abc.GuildChannel) - The channel to update
+      changed_overwrites (dict) - discord.Member -> discord.PermissionOverwrite
+      priority (int) - ACTION_PRIORITY_USER or ACTION_PRIORITY_SWEEP
+
+    Returns
+    _______
+
+      The number of requests made
+
+    """
+    if not changed_overwrites:
+        return 0
+
+    if len(changed_overwrites) >= CHANNEL_BULK_OVERWRITE_THRESHOLD:
+
+        async def edit_overwrites():
+            # read the overwrites when the edit is made so writes queued before it aren't undone
+            overwrites = dict(channel.overwrites)
+            overwrites.update(changed_overwrites)
+            await channel.edit(overwrites=overwrites)
+
+        await action_queue.run(
+            channel.guild.id, ACTION_ROUTE_CHANNEL_EDIT, None, edit_overwrites, priority
+        )
+        return 1
+
+    await asyncio.gather(
+        *[
+            set_member_overwrite(channel, member, overwrite, priority)
+            for member, overwrite in changed_overwrites.items()
+        ]
+    )
+    return len(changed_overwrites)
+
+
+async def reconcile_member_channels(
+    member, channel_index, amounts, priority=ACTION_PRIORITY_SWEEP
+):
+    """
+    Bring a member's overwrites on every mapped channel in line with the channel mappings.
+
+    Parameters
+    __________
+
+      member (discord.Member) - The discord member to check
+      channel_index (ThresholdIndex) - Compiled channel mappings of the member's guild
+      amounts (dict)  - coin -> amount held by the member
+      priority (int) - ACTION_PRIORITY_USER or ACTION_PRIORITY_SWEEP
+
+    Returns
+    _______
+
+      The number of requests made
+
+    """
+    if amounts is None:
+        return 0
+
+    allowed_channels = channel_index.qualifying(amounts)
+    writes = 0
+    for channel in channel_index.targets:
+        overwrite = get_target_overwrite(channel, member, channel in allowed_channels)
+        if overwrite is not None:
+            await set_member_overwrite(channel, member, overwrite, priority)
+            writes += 1
+    return writes
+
+
+async def grant_deny_channel_to_member(channel_mapping, member, balances, guild_index=None):
     """
     Determine if the rally_id and balance for a channel is still valid for a particular member
     Update status in database.
@@ -38,50 +191,126 @@ async def grant_deny_channel_to_member(channel_mapping, member, balances):
     Parameters
     __________
 
-      channel_mapping  (list) - list of information for the channel mapped to the member
+      channel_mapping  (dict) - The channel mapping to apply to the member
       member (discord.Member) - The discord member to check
       balances (list)  - The amount of coin allocated to this member per coin
+      guild_index (GuildIndex) - Index of the member's guild, built if not given
+
+    Returns
+    _______
+
+      The number of overwrites written
 
     """
 
-    print("Checking channel")
-    rally_id = data.get_rally_id(member.id)
-    if rally_id is None or balances is None:
-        return
-    matched_channels = [
-        channel
-        for channel in member.guild.channels
-        if channel.name == channel_mapping[data.CHANNEL_NAME_KEY]
-    ]
-    if len(matched_channels) == 0:
-        return
-
-    channel_to_assign = matched_channels[0]
-    if channel_to_assign is not None:
-        if (
-                rally_api.find_balance_of_coin(
-                    channel_mapping[data.COIN_KIND_KEY], balances
-                )
-                >= channel_mapping[data.REQUIRED_BALANCE_KEY]
-        ):
-            perms = channel_to_assign.overwrites_for(member)
-            perms.send_messages = True
-            perms.read_messages = True
-            perms.read_message_history = True
-            await channel_to_assign.set_permissions(member, overwrite=perms)
-            print("Assigned channel to member")
-        else:
-            perms = channel_to_assign.overwrites_for(member)
-            perms.send_messages = False
-            perms.read_messages = False
-            perms.read_message_history = False
-            await channel_to_assign.set_permissions(member, overwrite=perms)
-            print("Removed channel to member")
-    else:
-        print("Channel not found")
+    if balances is None:
+        return 0
+    guild_index = guild_index or GuildIndex(member.guild)
+    channel = guild_index.channels.get(channel_mapping[data.CHANNEL_NAME_KEY])
+    if channel is None:
+        return 0
+
+    channel_index = ThresholdIndex([(channel_mapping, channel)])
+    return await reconcile_member_channels(
+        member, channel_index, parse_balances(balances), ACTION_PRIORITY_USER
+    )
 
 
-async def grant_deny_role_to_member(role_mapping, member, balances):
+def get_target_roles(member, role_index, amounts):
+    """
+    Compute the set of roles a member should have according to the guild's role mappings.
+
+    Roles that aren't mapped are left as they are, mapped roles are added when the
+    member holds enough of the coin and removed otherwise.
+
+    Parameters
+    __________
+
+      member (discord.Member) - The discord member to check
+      role_index (ThresholdIndex) - Compiled role mappings of the member's guild
+      amounts (dict)  - coin -> amount held by the member
+
+    """
+    # member.roles[0] is always the guild's default role
+    target_roles = set(member.roles[1:])
+    target_roles.difference_update(role_index.targets)
+    target_roles.update(role_index.qualifying(amounts))
+    return target_roles
+
+
+async def reconcile_member_roles(
+    member, role_index, amounts, priority=ACTION_PRIORITY_SWEEP
+):
+    """
+    Bring a member's roles in line with the role mappings using at most one member edit.
+
+    Parameters
+    __________
+
+      member (discord.Member) - The discord member to check
+      role_index (ThresholdIndex) - Compiled role mappings of the member's guild
+      amounts (dict)  - coin -> amount held by the member
+      priority (int) - ACTION_PRIORITY_USER or ACTION_PRIORITY_SWEEP
+
+    Returns
+    _______
+
+      True if the member's roles were edited, False if they were already correct
+
+    """
+    if amounts is None or not role_index:
+        return False
+
+    return await set_member_roles(
+        member, get_target_roles(member, role_index, amounts), priority
+    )
+
+
+async def set_member_roles(member, target_roles, priority=ACTION_PRIORITY_SWEEP):
+    """
+    Give a member the target roles with one member edit, unless they already have them.
+
+    Only the roles to add and remove are queued, the edit applies them to the roles the member
+    has when it's made, so role changes made while it waited in the action queue aren't undone.
+
+    Parameters
+    __________
+
+      member (discord.Member) - The discord member to edit
+      target_roles (set) - Every role the member should have, without the default role
+      priority (int) - ACTION_PRIORITY_USER or ACTION_PRIORITY_SWEEP
+
+    Returns
+    _______
+
+      True if the member's roles were edited, False if they were already correct
+
+    """
+    # an edit that's still queued may be based on older balances, so it's replaced even if
+    # the cached roles already match
+    pending = action_queue.is_pending(
+        member.guild.id, ACTION_ROUTE_MEMBER_ROLES, member.id
+    )
+    current_roles = set(member.roles[1:])
+    if target_roles == current_roles and not pending:
+        return False
+
+    add_roles = target_roles - current_roles
+    remove_roles = current_roles - target_roles
+
+    async def edit_roles():
+        roles = set(member.roles[1:])
+        target = (roles - remove_roles) | add_roles
+        if target != roles:
+            await member.edit(roles=sorted(target))
+
+    await action_queue.run(
+        member.guild.id, ACTION_ROUTE_MEMBER_ROLES, member.id, edit_roles, priority
+    )
+    return True
+
+
+async def grant_deny_role_to_member(role_mapping, member, balances, guild_index=None):
     """
     Determine if the rally_id and balance for a role is still valid for a particular member
     Update status in database.
@@ -89,41 +318,291 @@ async def grant_deny_role_to_member(role_mapping, member, balances):
     Parameters
     __________
 
-      channel_mapping (list) - list of information for the channel mapped to the member
+      role_mapping (dict) - The role mapping to apply to the member
       member (discord.Member) - The discord member to check
       balances (list)  - The amount allocated to this member per coin
+      guild_index (GuildIndex) - Index of the member's guild, built if not given
 
     """
 
-    rally_id = data.get_rally_id(member.id)
-    if rally_id is None or balances is None:
-        return
-    role_to_assign = get(member.guild.roles, name=role_mapping[data.ROLE_NAME_KEY])
-    if (
-            rally_api.find_balance_of_coin(role_mapping[data.COIN_KIND_KEY], balances)
-            >= role_mapping[data.REQUIRED_BALANCE_KEY]
-    ):
-        if role_to_assign is not None:
-            await member.add_roles(role_to_assign)
-            print("Assigned role to member")
-        else:
-            print("Can't find role")
-            print(role_mapping["role"])
+    if balances is None:
+        return False
+    guild_index = guild_index or GuildIndex(member.guild)
+    role_index = ThresholdIndex(guild_index.resolve_role_mappings([role_mapping]))
+    return await reconcile_member_roles(
+        member, role_index, parse_balances(balances), ACTION_PRIORITY_USER
+    )
+
+
+def get_role_edits(guild, role_index, member_amounts):
+    """
+    Compute the roles of the members whose mapped roles differ from what they qualify for.
+
+    Members with a queued role edit are included too, the edit may be based on older balances.
+
+    Parameters
+    __________
+
+      guild (discord.Guild) - The guild of the members
+      role_index (ThresholdIndex) - Compiled role mappings of the guild
+      member_amounts (list) - (member, amounts) of the members to check
+
+    Returns
+    _______
+
+      list of (member, target roles) tuples
+
+    """
+    if not role_index:
+        return []
+
+    pending = action_queue.pending_targets(guild.id, ACTION_ROUTE_MEMBER_ROLES)
+    if use_vectorized(len(member_amounts)):
+        # flipping the differing roles gives the roles the members should have
+        changes = role_index.changes(
+            [amounts for _, amounts in member_amounts],
+            [member.roles for member, _ in member_amounts],
+        )
+        return [
+            (member, set(member.roles[1:]) ^ changes.get(row, frozenset()))
+            for row, (member, _) in enumerate(member_amounts)
+            if row in changes or member.id in pending
+        ]
+
+    role_edits = []
+    for member, amounts in member_amounts:
+        target_roles = get_target_roles(member, role_index, amounts)
+        if target_roles != set(member.roles[1:]) or member.id in pending:
+            role_edits.append((member, target_roles))
+    return role_edits
+
+
+def get_changed_overwrites(channel_index, member_amounts):
+    """
+    Compute the member overwrites of the mapped channels that differ from what the members qualify for.
+
+    Parameters
+    __________
+
+      channel_index (ThresholdIndex) - Compiled channel mappings of the guild
+      member_amounts (list) - (member, amounts) of the members to check
+
+    Returns
+    _______
+
+      dict of channel -> {member: discord.PermissionOverwrite}
+
+    """
+    if not channel_index:
+        return {}
+
+    amounts_list = [amounts for _, amounts in member_amounts]
+    if use_vectorized(len(amounts_list)):
+        channels, allowed = channel_index.qualifying_matrix(amounts_list)
+        allowed_list = [
+            {channel for channel, qualifies in zip(channels, row) if qualifies}
+            for row in allowed.tolist()
+        ]
+    else:
+        allowed_list = [channel_index.qualifying(amounts) for amounts in amounts_list]
+
+    changed_overwrites = {channel: {} for channel in channel_index.targets}
+    for (member, _), allowed_channels in zip(member_amounts, allowed_list):
+        for channel in channel_index.targets:
+            overwrite = get_target_overwrite(channel, member, channel in allowed_channels)
+            if overwrite is not None:
+                changed_overwrites[channel][member] = overwrite
+    return changed_overwrites
+
+
+def get_linked_members(guild, rally_connections):
+    """
+    Yield the members of a guild that have linked a rally id.
+
+    Walks whichever side is smaller, the linked accounts or the guild's members,
+    and looks the other side up in memory.
+
+    Parameters
+    __________
+
+      guild (discord.Guild) - The guild to get members from
+      rally_connections (dict) - discord id -> rally id, as returned by data.get_rally_connections
+
+    """
+    if len(rally_connections) < len(guild.members):
+        for discord_id, rally_id in rally_connections.items():
+            member = guild.get_member(discord_id)
+            if member is not None:
+                yield member, rally_id
     else:
-        if role_to_assign in member.roles:
-            await member.remove_roles(role_to_assign)
-            print("Removed role to member")
+        for member in guild.members:
+            rally_id = rally_connections.get(member.id)
+            if rally_id:
+                yield member, rally_id
+
 
+# one time mapping jobs that are still running, see run_one_time_mapping
+one_time_mapping_jobs = set()
 
-async def force_update(bot, ctx):
-    await bot.get_cog("UpdateTask").force_update(ctx)
+
+def run_one_time_mapping(ctx, apply_mapping):
+    """
+    Apply a one time mapping to every linked member of the command's guild as a background job,
+    so big servers don't hold up the command for minutes.
+
+    Balances come from the balance cache and at most ONE_TIME_MAPPING_CONCURRENCY members
+    are handled at a time. Progress is posted every ONE_TIME_MAPPING_PROGRESS_INTERVAL
+    seconds, followed by a summary once every member was handled.
+
+    Parameters
+    __________
+
+      ctx (discord.Context) - The invocation context of the one time mapping command
+      apply_mapping (coroutine function) - Called with (member, balances),
+                                           returns whether the member was changed
+
+    Returns
+    _______
+
+      The asyncio.Task of the job
+
+    """
+
+    async def job():
+        start = time.monotonic()
+        rally_connections = await run_db(data.get_rally_connections) or {}
+        linked_members = list(get_linked_members(ctx.guild, rally_connections))
+        semaphore = asyncio.Semaphore(ONE_TIME_MAPPING_CONCURRENCY)
+        counts = Counter()
+
+        async def apply(member, rally_id):
+            async with semaphore:
+                balances = await rally_api.balance_cache.get(rally_id)
+                if balances is None:
+                    counts["failed"] += 1
+                    return
+                try:
+                    changed = await apply_mapping(member, balances)
+                except discord.HTTPException as e:
+                    print(f"Failed to apply one time mapping to {member}: {e}")
+                    counts["failed"] += 1
+                    return
+                counts["changed" if changed else "unchanged"] += 1
+
+        progress = await ctx.send(
+            f"Applying the mapping to {len(linked_members)} linked members..."
+        )
+
+        async def report_progress():
+            while True:
+                await asyncio.sleep(ONE_TIME_MAPPING_PROGRESS_INTERVAL)
+                await progress.edit(
+                    content=f"Applying the mapping... {sum(counts.values())}"
+                    f"/{len(linked_members)} members done"
+                )
+
+        reporter = asyncio.ensure_future(report_progress())
+        try:
+            # every member is attempted, one member's unexpected error doesn't abandon the rest
+            results = await asyncio.gather(
+                *[apply(member, rally_id) for member, rally_id in linked_members],
+                return_exceptions=True,
+            )
+        finally:
+            reporter.cancel()
+
+        for (member, _), result in zip(linked_members, results):
+            if isinstance(result, Exception):
+                print(f"Failed to apply one time mapping to {member}: {result!r}")
+                counts["failed"] += 1
+
+        await pretty_print(
+            ctx,
+            [
+                ["Changed", counts["changed"]],
+                ["Unchanged", counts["unchanged"]],
+                ["Failed", counts["failed"]],
+                ["Took", f"{round(time.monotonic() - start)}s"],
+            ],
+            title="One time mapping applied",
+            color=SUCCESS_COLOR,
+        )
+
+    task = asyncio.ensure_future(job())
+    # the event loop only keeps weak references to tasks, a running job must not be collected
+    one_time_mapping_jobs.add(task)
+    task.add_done_callback(one_time_mapping_jobs.discard)
+    return task
+
+
+async def force_update(bot, ctx, scope=UPDATE_SCOPE_ALL):
+    bot.get_cog("UpdateTask").queue_update(ctx.guild.id, scope=scope)
+    await ctx.send("Updating!")
+
+
+class UpdateEngine:
+    """
+    Update state shared by the UpdateTask cogs of every bot instance in the process.
+
+    There's one sweep schedule, update queue and set of guild locks for all instances,
+    the sweep and queue loops only run on the main bot. A guild reachable by several
+    instances is updated once, through the bot that owns it: its custom bot instance
+    if that instance is running and in the guild, otherwise the main bot.
+    """
+
+    def __init__(self):
+        self.sweep_lock = asyncio.Lock()
+        self.guild_locks = defaultdict(asyncio.Lock)
+        self.update_queue = UpdateQueue()
+        self.queue_semaphore = asyncio.Semaphore(UPDATE_QUEUE_CONCURRENCY)
+        self.queue_locks = defaultdict(asyncio.Lock)
+        self.queue_tasks = set()
+        self.chunk_tracker = ChunkTracker()
+        self.cadence = GuildCadence()
+
+    @staticmethod
+    async def get_guilds():
+        """
+        Get every guild reachable by a running bot, each once, as seen by the bot that owns it.
+
+        Returns
+        _______
+
+          dict of guild id -> discord.Guild
+
+        """
+        with sweep_metrics.db_call():
+            instances = await run_db(data.get_all_bot_instances) or []
+        instance_owners = {
+            int(instance[GUILD_ID_KEY]): instance.get(BOT_ID_KEY)
+            for instance in instances
+        }
+
+        bots = [main.main_bot] if main.main_bot else []
+        bots += [
+            running_bot["bot"]
+            for running_bot in main.running_bots.values()
+            if running_bot["bot"] is not main.main_bot
+        ]
+
+        guilds = {}
+        for bot in bots:
+            for guild in bot.guilds:
+                owner_id = instance_owners.get(guild.id)
+                if guild.id not in guilds or (
+                    owner_id and str(owner_id) == str(bot.user.id)
+                ):
+                    guilds[guild.id] = guild
+        return guilds
+
+
+update_engine = UpdateEngine()
 
 
 class UpdateTask(commands.Cog):
     def __init__(self, bot: main.RallyRoleBot):
         self.bot = bot
-        self.update_lock = threading.Lock()
-        self.task_run_lock = threading.Lock()
+        self.engine = update_engine
 
     @errors.standard_error_handler
     async def cog_command_error(self, ctx, error):
@@ -133,76 +612,467 @@ class UpdateTask(commands.Cog):
             type(error), error, error.__traceback__, file=sys.stderr
         )
 
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        self.queue_update(member.guild.id, member.id)
+
     @commands.command(name="update", help="Force an immediate update")
     @validation.owner_or_permissions(administrator=True)
     async def force_update(self, ctx):
-        self.update.restart()
-        await ctx.send("Updating!")
+        await force_update(self.bot, ctx)
+
+    def queue_update(self, guild_id=None, member_id=None, scope=UPDATE_SCOPE_ALL):
+        """
+        Queue a targeted update instead of waiting for the next full sweep.
+
+        Parameters
+        __________
+
+          guild_id (int) - Guild to update, None for every guild the member is in
+          member_id (int) - Member to update, None for every linked member of the guild
+          scope (str) - UPDATE_SCOPE_ALL, UPDATE_SCOPE_ROLES or UPDATE_SCOPE_CHANNELS
+
+        """
+        self.engine.update_queue.put(UpdateItem(guild_id, member_id, scope))
+
+    async def update_guild(
+        self,
+        guild,
+        rally_connections,
+        stats,
+        scope=UPDATE_SCOPE_ALL,
+        max_age=None,
+        snapshots=None,
+        new_snapshots=None,
+        priority=ACTION_PRIORITY_SWEEP,
+    ):
+        """
+        Update the roles and channel permissions of a guild's linked members.
+
+        Parameters
+        __________
+
+          guild (discord.Guild) - The guild to update
+          rally_connections (dict) - discord id -> rally id of the members to update
+          stats (collections.Counter) - Counters to add this update's numbers to
+          scope (str) - UPDATE_SCOPE_ALL, UPDATE_SCOPE_ROLES or UPDATE_SCOPE_CHANNELS
+          max_age (float) - Maximum age of cached balances, see BalanceCache.get
+          snapshots (dict) - (guild id, rally id) -> amounts last seen in that guild, members whose
+                             balance didn't cross a threshold since then are skipped. None checks everyone.
+          new_snapshots (dict) - Filled with (guild id, rally id) -> amounts fetched by this update, only
+                                 for members whose roles and channels were updated successfully
+          priority (int) - Priority of the discord writes, ACTION_PRIORITY_USER or ACTION_PRIORITY_SWEEP
+
+        """
+        role_index, channel_index = await compile_guild_mappings(guild)
+        if scope == UPDATE_SCOPE_CHANNELS:
+            role_index = ThresholdIndex([])
+        elif scope == UPDATE_SCOPE_ROLES:
+            channel_index = ThresholdIndex([])
+
+        stats["guilds"] += 1
+        stats["mappings"] += len(role_index) + len(channel_index)
+        stats["members"] += len(guild.members)
+        if not role_index and not channel_index:
+            return
+
+        # members whose update failed keep their old snapshot, so the next sweep retries them
+        failed_members = set()
+
+        linked_members = list(get_linked_members(guild, rally_connections))
 
-    @discord_tasks.loop(seconds=5)
-    async def run_tasks(self):
+        # fetch all balances of the guild concurrently, bounded by the rally client pool
+        with sweep_metrics.timer(METRICS_PHASE_RALLY):
+            all_balances = await asyncio.gather(
+                *[
+                    rally_api.balance_cache.get(rally_id, max_age=max_age)
+                    for _, rally_id in linked_members
+                ]
+            )
+        sweep_metrics.count(
+            METRICS_SERVICE_RALLY,
+            guild.id,
+            calls=len(all_balances),
+            errors=all_balances.count(None),
+        )
+
+        with sweep_metrics.timer(METRICS_PHASE_EVALUATE):
+            member_amounts = []
+            fetched = []
+            for (member, rally_id), balances in zip(linked_members, all_balances):
+                if balances is None:
+                    continue
+
+                stats["balances_checked"] += 1
+                amounts = parse_balances(balances)
+                fetched.append((member, rally_id, amounts))
+
+                previous = None if snapshots is None else snapshots.get((guild.id, rally_id))
+                if previous is not None:
+                    if not role_index.crossed(
+                        previous, amounts
+                    ) and not channel_index.crossed(previous, amounts):
+                        stats["short_circuited"] += 1
+                        continue
+
+                member_amounts.append((member, amounts))
+
+        # the guild lock is only held while the target state is computed. Writes wait in the
+        # action queue after it's released, conflicting writes are coalesced per member there and
+        # read the member's current roles and overwrites when they're made.
+        async with self.engine.guild_locks[guild.id]:
+            with sweep_metrics.timer(METRICS_PHASE_EVALUATE):
+                role_edits = get_role_edits(guild, role_index, member_amounts)
+                changed_overwrites = get_changed_overwrites(channel_index, member_amounts)
+
+        if role_index:
+            stats["roles_unchanged"] += len(member_amounts) - len(role_edits)
+            # the action queue paces the edits, so they can all be submitted at once
+            with sweep_metrics.timer(METRICS_PHASE_DISCORD):
+                results = await asyncio.gather(
+                    *[
+                        set_member_roles(member, target_roles, priority)
+                        for member, target_roles in role_edits
+                    ],
+                    return_exceptions=True,
+                )
+
+            edited = failed = 0
+            for (member, _), result in zip(role_edits, results):
+                if isinstance(result, discord.HTTPException):
+                    print(f"Failed to update roles of {member}: {result}")
+                    failed_members.add(member.id)
+                    failed += 1
+                elif isinstance(result, Exception):
+                    raise result
+                elif result:
+                    edited += 1
+                else:
+                    stats["roles_unchanged"] += 1
+            stats["roles_edited"] += edited
+            sweep_metrics.count(
+                METRICS_SERVICE_DISCORD, guild.id, calls=edited + failed, errors=failed
+            )
+
+        if channel_index:
+            await self.update_guild_channels(
+                guild, changed_overwrites, len(member_amounts), stats, failed_members, priority
+            )
+
+        if new_snapshots is not None:
+            for member, rally_id, amounts in fetched:
+                if member.id not in failed_members:
+                    new_snapshots[(guild.id, rally_id)] = amounts
+
+    async def update_guild_channels(
+        self, guild, changed_overwrites, member_count, stats, failed_members, priority
+    ):
+        """
+        Write the changed channel permissions of a guild's linked members.
+
+        Parameters
+        __________
+
+          guild (discord.Guild) - The guild to update
+          changed_overwrites (dict) - channel -> {member: overwrite}, as returned by get_changed_overwrites
+          member_count (int) - Number of members that were evaluated
+          stats (collections.Counter) - Counters to add this update's numbers to
+          failed_members (set) - Filled with the ids of members whose overwrites couldn't be written
+          priority (int) - Priority of the discord writes, ACTION_PRIORITY_USER or ACTION_PRIORITY_SWEEP
+
+        """
+        for channel, channel_overwrites in changed_overwrites.items():
+            try:
+                with sweep_metrics.timer(METRICS_PHASE_DISCORD):
+                    writes = await apply_channel_overwrites(
+                        channel, channel_overwrites, priority
+                    )
+            except discord.HTTPException as e:
+                print(f"Failed to update permissions of {channel}: {e}")
+                sweep_metrics.count(METRICS_SERVICE_DISCORD, guild.id, errors=1)
+                failed_members.update(member.id for member in channel_overwrites)
+                continue
+            sweep_metrics.count(METRICS_SERVICE_DISCORD, guild.id, calls=writes)
+            stats["overwrites_changed"] += len(channel_overwrites)
+            stats["overwrites_written"] += writes
+            stats["overwrites_saved"] += member_count - writes
+
+    @discord_tasks.loop(seconds=0)
+    async def process_update_queue(self):
         await self.bot.wait_until_ready()
-        with self.task_run_lock:
-            all_tasks = data.get_tasks()
-            for task in all_tasks:
-                try:
-                    # get function object and kwargs
-                    task_function = getattr(tasks, task['function'])
-                    kwargs = task['kwargs']
+        item = await self.engine.update_queue.get()
+        # items are processed concurrently, so one big guild doesn't hold up the others.
+        # The semaphore is taken before the item, items that wait stay in the queue to be coalesced.
+        await self.engine.queue_semaphore.acquire()
+        task = asyncio.ensure_future(self.dispatch_update_item(item))
+        self.engine.queue_tasks.add(task)
+        task.add_done_callback(self.engine.queue_tasks.discard)
 
-                    # call function
-                    asyncio.create_task(task_function(**kwargs))
+    async def dispatch_update_item(self, item):
+        try:
+            # tasks take the lock in the order they were created, so a guild's items run in order
+            async with self.engine.queue_locks[item.guild_id]:
+                await self.process_update_item(item)
+        except Exception as e:
+            # one bad item mustn't stop the loop, the next sweep catches it up anyway
+            print(f"Failed to process {item}: {e!r}")
+            traceback.print_exc()
+        finally:
+            self.engine.queue_semaphore.release()
 
-                    # delete task
-                    data.delete_task(task['id'])
-                except Exception as e:
-                    print(e)
+    async def process_update_item(self, item):
+        if item.member_id is None:
+            with sweep_metrics.db_call(item.guild_id):
+                rally_connections = await run_db(data.get_rally_connections) or {}
+        else:
+            with sweep_metrics.db_call(item.guild_id):
+                rally_id = await run_db(data.get_rally_id, item.member_id)
+            if not rally_id:
+                return
+            rally_connections = {item.member_id: rally_id}
+
+        if item.guild_id is None:
+            guilds = [
+                g
+                for g in (await self.engine.get_guilds()).values()
+                if g.get_member(item.member_id)
+            ]
+        else:
+            guild = (await self.engine.get_guilds()).get(int(item.guild_id))
+            guilds = [guild] if guild else []
 
-    @discord_tasks.loop(seconds=UPDATE_WAIT_TIME)
+        stats = Counter()
+        for guild in guilds:
+            try:
+                await self.update_guild(
+                    guild,
+                    rally_connections,
+                    stats,
+                    item.scope,
+                    priority=ACTION_PRIORITY_USER,
+                )
+            except Exception as e:
+                print(f"Failed to process {item} in {guild.id}: {e!r}")
+
+    @discord_tasks.loop(seconds=UPDATE_TICK_TIME)
     async def update(self):
+        """
+        Sweep over the guilds that are due, a slow consistency pass behind the targeted updates
+        queued by mapping changes, member joins and newly linked rally ids.
+        How often a guild is due is adapted to how often its sweeps change something.
+        """
         await self.bot.wait_until_ready()
-        with self.update_lock:
-
-            print("Updating roles")
-            guilds = self.bot.guilds
-            guild_count = 0
-            member_count = 0
-            mapping_count = 0
-
-            for guild in guilds:
-
-                guild_count += 1
-                await guild.chunk()
-
-                role_mappings = list(data.get_role_mappings(guild.id))
-                channel_mappings = list(data.get_channel_mappings(guild.id))
-                mapping_count += len(role_mappings) + len(channel_mappings)
-
-                for member in guild.members:
-                    member_count += 1
-                    rally_id = data.get_rally_id(member.id)
-                    if rally_id:
-                        balances = rally_api.get_balances(rally_id)
-                        for role_mapping in role_mappings:
-                            print(role_mapping)
-                            await grant_deny_role_to_member(
-                                role_mapping, member, balances
-                            )
-                        for channel_mapping in channel_mappings:
-                            await grant_deny_channel_to_member(
-                                channel_mapping, member, balances
-                            )
+
+        # a sweep that's still running already covers everything this one would do
+        if self.engine.sweep_lock.locked():
+            print("Previous update is still running, skipping")
+            return
+
+        async with self.engine.sweep_lock:
+
+            with sweep_metrics.db_call():
+                overrides = await run_db(data.get_update_intervals) or {}
+            guilds = [
+                guild
+                for guild in (await self.engine.get_guilds()).values()
+                if self.engine.cadence.is_due(guild.id, overrides.get(guild.id))
+            ]
+            if not guilds:
+                return
+
+            print(f"Updating roles in {len(guilds)} guilds")
+            sweep_start = time.monotonic()
+            rally_api.balance_cache.new_cycle()
+            with sweep_metrics.db_call():
+                rally_connections = await run_db(data.get_rally_connections) or {}
+            stats = Counter()
+
+            # skip members whose balances didn't cross a threshold, except on every n-th sweep of a guild
+            with sweep_metrics.db_call():
+                snapshots = await run_db(data.get_balance_snapshots) or {}
+            new_snapshots = {}
+
+            # guilds are updated concurrently so one big guild doesn't hold up the others
+            guild_semaphore = asyncio.Semaphore(GUILD_CONCURRENCY)
+
+            async def sweep_guild(guild):
+                guild_stats = Counter()
+                full_reconcile = self.engine.cadence.is_full_reconcile(guild.id)
+                try:
+                    async with guild_semaphore:
+                        with sweep_metrics.timer(METRICS_PHASE_CHUNK):
+                            await self.engine.chunk_tracker.ensure_chunked(guild)
+                        await self.update_guild(
+                            guild,
+                            rally_connections,
+                            guild_stats,
+                            max_age=0,
+                            snapshots=None if full_reconcile else snapshots,
+                            new_snapshots=new_snapshots,
+                        )
+                finally:
+                    # failed guilds are rescheduled too, so they aren't retried every tick
+                    self.engine.cadence.record(
+                        guild.id,
+                        guild_stats["balances_checked"],
+                        guild_stats["roles_edited"] + guild_stats["overwrites_changed"],
+                    )
+                    stats.update(guild_stats)
+
+            try:
+                results = await asyncio.gather(
+                    *[sweep_guild(guild) for guild in guilds], return_exceptions=True
+                )
+            finally:
+                # outside of the sweep, balances it fetched are only reused until the ttl
+                rally_api.balance_cache.end_cycle()
+            for guild, result in zip(guilds, results):
+                if isinstance(result, Exception):
+                    print(f"Failed to update {guild}: {result!r}")
+
+            changed_snapshots = {
+                key: amounts
+                for key, amounts in new_snapshots.items()
+                if snapshots.get(key) != amounts
+            }
+            if changed_snapshots:
+                with sweep_metrics.db_call():
+                    await run_db(data.set_balance_snapshots, changed_snapshots)
+
+            stats["balance_cache_hits"] = rally_api.balance_cache.hits
+            stats["balance_cache_misses"] = rally_api.balance_cache.misses
+            stats["prefix_cache_hits"] = prefix_cache.hits
+            stats["prefix_cache_misses"] = prefix_cache.misses
+            sweep_metrics.finish_sweep(stats, time.monotonic() - sweep_start)
+            try:
+                # the api runs in its own process and serves these from the database
+                await run_db(
+                    data.set_sweep_metrics, sweep_metrics.render() + task_queue.render()
+                )
+            except Exception as e:
+                print(f"Failed to store sweep metrics: {e!r}")
 
             print(
                 "Done! Checked "
-                + str(guild_count)
+                + str(stats["guilds"])
                 + " guilds. "
-                + str(mapping_count)
+                + str(stats["mappings"])
                 + " mappings. "
-                + str(member_count)
-                + " members."
+                + str(stats["members"])
+                + " members. "
+                + str(stats["roles_edited"])
+                + " role edits, "
+                + str(stats["roles_unchanged"])
+                + " members unchanged, "
+                + str(stats["short_circuited"])
+                + " skipped by balance snapshot. "
+                + str(stats["overwrites_written"])
+                + " overwrite writes, "
+                + str(stats["overwrites_saved"])
+                + " saved. Balance cache: "
+                + str(rally_api.balance_cache.hits)
+                + " hits, "
+                + str(rally_api.balance_cache.misses)
+                + " misses. Chunked "
+                + str(self.engine.chunk_tracker.chunk_requests)
+                + " guilds, "
+                + str(self.engine.chunk_tracker.chunks_skipped)
+                + " chunks skipped. Took "
+                + str(round(sweep_metrics.last_sweep_time, 1))
+                + " seconds."
+            )
+            print(f"Action queue: {action_queue.stats()}")
+
+    @commands.command(
+        name="update_interval",
+        help=" <minutes> How often roles and channels are checked in this server, "
+        + "0 adapts it to how often balances change",
+    )
+    @commands.guild_only()
+    @validation.owner_or_permissions(administrator=True)
+    async def set_update_interval(self, ctx, minutes: int):
+        if minutes and not CADENCE_MIN_INTERVAL <= minutes * 60 <= CADENCE_MAX_INTERVAL:
+            return await pretty_print(
+                ctx,
+                f"The interval must be 0 or between {CADENCE_MIN_INTERVAL // 60} "
+                f"and {CADENCE_MAX_INTERVAL // 60} minutes",
+                title="Error",
+                color=ERROR_COLOR,
+            )
+
+        await run_db(data.set_update_interval, ctx.guild.id, minutes * 60 or None)
+        interval = self.engine.cadence.interval(ctx.guild.id, minutes * 60)
+        await pretty_print(
+            ctx,
+            f"Roles and channels are checked every {round(interval / 60)} minutes"
+            + ("" if minutes else ", adapted to how often balances change"),
+            title="Success",
+            color=SUCCESS_COLOR,
+        )
+
+    @commands.command(
+        name="sweepstats", help="Show timings and call counts of the role updates"
+    )
+    @validation.owner_or_permissions(administrator=True)
+    async def sweep_stats(self, ctx):
+        last_sweep = sweep_metrics.last_sweep
+        if sweep_metrics.last_sweep_time is None:
+            summary = "No sweep has finished yet"
+        else:
+            summary = (
+                f"{round(sweep_metrics.last_sweep_time, 1)}s, "
+                f"{last_sweep.get('guilds', 0)} guilds, "
+                f"{last_sweep.get('members', 0)} members, "
+                f"{last_sweep.get('roles_edited', 0)} role edits, "
+                f"{last_sweep.get('overwrites_written', 0)} overwrite writes"
             )
 
+        phases = []
+        for phase, histogram in sorted(sweep_metrics.phases.items()):
+            average = histogram.sum / histogram.count if histogram.count else 0
+            phases.append(
+                f"{phase}: {histogram.count} x {round(average * 1000)}ms avg, "
+                f"{round(histogram.sum, 1)}s total"
+            )
+
+        calls = []
+        for service in (
+            METRICS_SERVICE_RALLY,
+            METRICS_SERVICE_DISCORD,
+            METRICS_SERVICE_DB,
+        ):
+            total, errors = sweep_metrics.totals(service)
+            calls.append(f"{service}: {total} calls, {errors} errors")
+
+        queue_stats = action_queue.stats()
+        await pretty_print(
+            ctx,
+            [
+                ["Last sweep", summary, False],
+                ["Phases", "\n".join(phases) or "-", False],
+                ["Calls", "\n".join(calls), False],
+                [
+                    "Action queue",
+                    f"{queue_stats['depth']} pending, "
+                    f"{round(queue_stats['wait_avg_sweep'], 2)}s average sweep wait",
+                    False,
+                ],
+                [
+                    "Tasks",
+                    f"{task_queue.executed} executed, {task_queue.retried} retried, "
+                    f"{task_queue.dead} dead",
+                    False,
+                ],
+                [
+                    "Prefix cache",
+                    f"{prefix_cache.hits} hits, {prefix_cache.misses} misses",
+                    False,
+                ],
+            ],
+            title="Sweep stats",
+            color=SUCCESS_COLOR,
+        )
+
     @commands.command(
         name='change_rally_id',
         help="updates your wallet balance / roles immediately"
@@ -211,48 +1081,50 @@ class UpdateTask(commands.Cog):
     async def set_rally_id(self, ctx):
         member = ctx.author
 
-        with self.update_lock:
-            for guild in self.bot.guilds:
-                await guild.chunk()
+        rally_id = await run_db(data.get_rally_id, member.id)
 
-                if member not in guild.members:
-                    continue
+        # the member cache is kept complete, so mutual guilds are found without chunking
+        for guild in (await self.engine.get_guilds()).values():
+            # ctx.author is only a member of the guild the command was sent in
+            guild_member = guild.get_member(member.id)
+            if guild_member is None:
+                continue
 
-                role_mappings = list(data.get_role_mappings(guild.id))
-                channel_mappings = list(data.get_channel_mappings(guild.id))
-
-                rally_id = data.get_rally_id(member.id)
-                if rally_id:
-                    balances = rally_api.get_balances(rally_id)
-                    for role_mapping in role_mappings:
-                        try:
-                            await grant_deny_role_to_member(
-                                role_mapping, member, balances
-                            )
-                        except discord.HTTPException:
-                            raise errors.RequestError("network error, try again later")
-                        except:
-                            # Forbidden, NotFound or Invalid Argument exceptions only called when code
-                            # or bot is wrongly synced / setup
-                            raise errors.FatalError("bot is setup wrong, call admin")
-                    for channel_mapping in channel_mappings:
-                        try:
-                            await grant_deny_channel_to_member(
-                                channel_mapping, member, balances
-                            )
-                        except discord.HTTPException:
-                            raise errors.RequestError("network error, try again later")
-                        except:
-                            # Forbidden, NotFound or Invalid Argument exceptions only called when code
-                            # or bot is wrongly synced / setup
-                            raise errors.FatalError("bot is setup wrong, call admin")
-
-            await pretty_print(
-                ctx,
-                "Command completed successfully!",
-                title="Success",
-                color=SUCCESS_COLOR,
-            )
+            role_index, channel_index = await compile_guild_mappings(guild)
+
+            if rally_id:
+                balances = await rally_api.balance_cache.get(rally_id)
+                if balances is None:
+                    raise errors.RequestError("network error, try again later")
+                member_amounts = [(guild_member, parse_balances(balances))]
+                # like update_guild, the lock is released before the writes are awaited
+                async with self.engine.guild_locks[guild.id]:
+                    role_edits = get_role_edits(guild, role_index, member_amounts)
+                    changed_overwrites = get_changed_overwrites(
+                        channel_index, member_amounts
+                    )
+                try:
+                    for _, target_roles in role_edits:
+                        await set_member_roles(
+                            guild_member, target_roles, ACTION_PRIORITY_USER
+                        )
+                    for channel, channel_overwrites in changed_overwrites.items():
+                        await apply_channel_overwrites(
+                            channel, channel_overwrites, ACTION_PRIORITY_USER
+                        )
+                except discord.HTTPException:
+                    raise errors.RequestError("network error, try again later")
+                except:
+                    # Forbidden, NotFound or Invalid Argument exceptions only called when code
+                    # or bot is wrongly synced / setup
+                    raise errors.FatalError("bot is setup wrong, call admin")
+
+        await pretty_print(
+            ctx,
+            "Command completed successfully!",
+            title="Success",
+            color=SUCCESS_COLOR,
+        )
 
 
 def setup(bot: main.RallyRoleBot):
@@ -1,7 +1,10 @@
 import configargparse
+import logging
 
 CONFIG = None
 
+logger = logging.getLogger(__name__)
+
 arg_parser = configargparse.ArgParser(default_config_files=["config.txt"])
 
 arg_parser.add("-c", "--config", is_config_file=True, help="Config file")
@@ -23,9 +26,19 @@ arg_parser.add("--host", default="127.0.0.1", help="Bind socket to this host")
 
 arg_parser.add("--port", default="8000", help="Bind socket to this port")
 
-arg_parser.add("--cache_max", default="5000", help="Maximun entries to store in cache")
+arg_parser.add(
+    "--price_retention_days", default="7", help="Days to keep the price history of a coin"
+)
+
+# replaced by --price_retention_days, still accepted so existing config files keep working
+arg_parser.add("--cache_max", help="Deprecated, has no effect")
 
 
 def parse_args():
     global CONFIG
     CONFIG = arg_parser.parse_args()
+    if CONFIG.cache_max is not None:
+        logger.warning(
+            "cache_max is deprecated and has no effect, "
+            "coin prices are kept for price_retention_days instead"
+        )
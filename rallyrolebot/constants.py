@@ -16,6 +16,7 @@ USERS_TABLE = "users"
 USERS_TOKEN_TABLE = "users_token"
 COMMANDS_TABLE = "commands"
 COIN_PRICE_TABLE = "coin_price"
+BALANCE_SNAPSHOTS_TABLE = "balance_snapshots"
 
 
 GUILD_ID_KEY = "guildId"
@@ -25,6 +26,8 @@ ROLE_NAME_KEY = "roleName"
 CHANNEL_NAME_KEY = "channel"
 DISCORD_ID_KEY = "discordId"
 RALLY_ID_KEY = "rallyId"
+BALANCES_KEY = "balances"
+TIME_UPDATED_KEY = "timeUpdated"
 
 BOT_TOKEN_KEY = "botToken"
 BOT_INSTANCES_KEY = "botInstances"
@@ -51,6 +54,8 @@ PREFIX_KEY = "prefix"
 CONFIG_NAME_KEY = "configName"
 PURCHASE_MESSAGE_KEY = "purchaseMessage"
 DONATE_MESSAGE_KEY = "donateMessage"
+TIERED_ROLES_KEY = "tieredRoles"
+UPDATE_INTERVAL_KEY = "updateInterval"
 
 ALERT_SETTINGS_TABLE = 'alerts_settings_table'
 ALERTS_SETTINGS_KEY = 'settings'
@@ -67,8 +72,57 @@ COIN_KIND_KEY = 'coinKind'
 
 EVENTS_TABLE = 'eventsTable'
 EVENT_KEY = 'event'
+AMOUNT_KEY = 'amount'
+
+# hourly per coin and event totals of eventsTable, kept up to date by data.add_event
+EVENT_ROLLUP_TABLE = 'event_rollup'
+HOUR_KEY = 'hour'
+COUNT_KEY = 'count'
+# seconds covered by one event_rollup row
+EVENT_ROLLUP_BUCKET = 60 * 60
 
 TASKS_TABLE = 'tasks_table'
+TASKS_DEAD_LETTER_TABLE = 'tasks_dead_letter'
+ATTEMPTS_KEY = 'attempts'
+RUN_AFTER_KEY = 'runAfter'
+CLAIMED_UNTIL_KEY = 'claimedUntil'
+ERROR_KEY = 'error'
+
+SWEEP_METRICS_TABLE = 'sweep_metrics'
+METRICS_KEY = 'metrics'
+
+SCHEMA_MIGRATIONS_TABLE = 'schema_migrations'
+VERSION_KEY = 'version'
+
+# coin symbol -> days its prices are kept, other coins use the price_retention_days config
+PRICE_RETENTION_OVERRIDES = {}
+# seconds between runs of the coin price retention
+PRICE_RETENTION_INTERVAL = 60 * 60
+
+CHANGE_LOG_TABLE = 'change_log'
+TABLE_NAME_KEY = 'tableName'
+# postgres NOTIFY channel of the change feed, see utils.change_feed
+CHANGE_FEED_CHANNEL = 'rallyrolebot_changes'
+# seconds between polls of the change_log table on databases without LISTEN/NOTIFY
+CHANGE_FEED_POLL_INTERVAL = 1
+# seconds a change_log row is kept, the bot only needs the ones it hasn't polled yet
+CHANGE_FEED_RETENTION = 60 * 60
+# seconds without a notification after which the LISTEN connection is checked
+CHANGE_FEED_KEEPALIVE = 60
+# seconds before a lost LISTEN connection is reopened
+CHANGE_FEED_RECONNECT_DELAY = 5
+
+# tasks the api queues for the bot, see utils.task_queue
+# tasks claimed and run at the same time
+TASK_QUEUE_BATCH_SIZE = 10
+# seconds a claimed task is reserved for the worker that claimed it
+TASK_LEASE_TIME = 60
+# seconds the queue waits for a notification before checking for due tasks anyway
+TASK_QUEUE_IDLE_POLL = 60
+# runs of a task before it's moved to the dead letter table
+TASK_MAX_ATTEMPTS = 5
+# seconds before the first retry, doubled on every further retry
+TASK_RETRY_BACKOFF = 2
 
 
 """
@@ -81,11 +135,97 @@ BASE_URL = "https://api.rally.io/v1"
 COINGECKO_API_URL = "https://api.coingecko.com/api/v3"
 DISCORD_API_URL = "https://discord.com/api"
 
+# database engine pool, overridden by the POOL_SIZE and MAX_OVERFLOW env vars,
+# keep these the same as app.json, the web and bot processes each have a pool
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 2
+# threads coroutines run blocking database calls in, see utils.ext.run_db,
+# capped at the pool's connections less the change feed's LISTEN connection
+DB_THREAD_POOL_SIZE = 6
+
+# async rally client
+RALLY_POOL_SIZE = 20
+RALLY_MAX_IN_FLIGHT = 20
+RALLY_KEEPALIVE_TIMEOUT = 60
+RALLY_REQUEST_TIMEOUT = 10
+RALLY_MAX_RETRIES = 2
+RALLY_RETRY_BACKOFF = 0.5
+
+# seconds a cached balance is reused outside of an update sweep
+BALANCE_CACHE_TTL = 60
+
 
 """
     Constants useful for update_cog module
 """
-UPDATE_WAIT_TIME = 600
+# full sweeps are a consistency pass, mapping changes, joins and new links queue targeted updates
+# starting interval of a guild's sweeps, adapted per guild by utils.cadence
+UPDATE_WAIT_TIME = 3600
+# how often the update loop checks which guilds are due
+UPDATE_TICK_TIME = 300
+
+# bounds of the adaptive per guild interval and how fast it moves
+CADENCE_MIN_INTERVAL = 300
+CADENCE_MAX_INTERVAL = 6 * 3600
+CADENCE_BACKOFF_FACTOR = 1.5
+CADENCE_SPEEDUP_FACTOR = 2
+# share of checked members an update has to change for the guild to count as volatile
+CADENCE_VOLATILE_RATIO = 0.05
+
+# number of guilds a sweep updates at the same time
+GUILD_CONCURRENCY = 4
+
+# number of queued targeted updates processed at the same time, items of one guild run in order
+UPDATE_QUEUE_CONCURRENCY = 8
+
+# discord writes made by the update cog go through utils.action_queue
+ACTION_QUEUE_WORKERS = 8
+ACTION_WAIT_SAMPLES = 1000
+ACTION_PRIORITY_USER = 0
+ACTION_PRIORITY_SWEEP = 1
+ACTION_ROUTE_MEMBER_ROLES = "member_roles"
+ACTION_ROUTE_CHANNEL_PERMISSIONS = "channel_permissions"
+ACTION_ROUTE_CHANNEL_EDIT = "channel_edit"
+# route -> (tokens per second, burst) of each guild's token bucket
+ACTION_RATE_LIMITS = {
+    ACTION_ROUTE_MEMBER_ROLES: (2, 10),
+    ACTION_ROUTE_CHANNEL_PERMISSIONS: (2, 10),
+    ACTION_ROUTE_CHANNEL_EDIT: (0.5, 2),
+}
+
+UPDATE_SCOPE_ALL = "all"
+UPDATE_SCOPE_ROLES = "roles"
+UPDATE_SCOPE_CHANNELS = "channels"
+
+# every n-th sweep reconciles all members, even the ones whose balances didn't cross a threshold
+SNAPSHOT_FULL_RECONCILE_INTERVAL = 6
+
+# number of changed member overwrites on one channel at which they're written in a single channel edit
+CHANNEL_BULK_OVERWRITE_THRESHOLD = 5
+
+# guilds with at least this many members to evaluate use the numpy evaluation, if numpy is installed.
+# None keeps every guild on the per member evaluation, compare the eval_py and eval_np benchmark rows first
+VECTORIZE_MIN_MEMBERS = None
+
+# one time mappings run in the background, this many members at a time
+ONE_TIME_MAPPING_CONCURRENCY = 20
+# seconds between progress updates of a one time mapping
+ONE_TIME_MAPPING_PROGRESS_INTERVAL = 10
+
+# update instrumentation, see utils.metrics
+METRICS_PREFIX = "rallyrolebot"
+METRICS_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900]
+METRICS_PHASE_CHUNK = "chunk"
+METRICS_PHASE_DB = "db"
+METRICS_PHASE_RALLY = "rally"
+METRICS_PHASE_EVALUATE = "evaluate"
+METRICS_PHASE_DISCORD = "discord"
+METRICS_PHASE_SWEEP = "sweep"
+METRICS_SERVICE_RALLY = "rally"
+METRICS_SERVICE_DISCORD = "discord"
+METRICS_SERVICE_DB = "db"
+# name of the row the bot stores the rendered metrics under for the api's /metrics route
+METRICS_ROW_NAME = "update"
 
 """
     Miscellaneous constants
@@ -117,4 +257,5 @@ API_TAGS_METADATA = [
     {"name": "bot_instance", "description": "Bot instances"},
     {"name": "bot_avatar", "description": "Configure bot avatar"},
     {"name": "bot_name", "description": "Configure bot name"},
+    {"name": "metrics", "description": "Role update metrics in the Prometheus text format"},
 ]
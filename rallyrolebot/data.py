@@ -3,7 +3,11 @@ import json
 import time
 
 from constants import *
-from utils.ext import connect_db
+from collections import Counter
+from dataset.util import index_name
+from sqlalchemy import Index, and_, func, or_, select
+from sqlalchemy.exc import IntegrityError, OperationalError
+from utils.ext import connect_db, insert_many
 
 """Functions for managing a dataset SQL database
     # Schemas
@@ -23,6 +27,12 @@ from utils.ext import connect_db
     #################### rally_connections ######################
     discordId
     rallyId
+
+    #################### balance_snapshots ######################
+    guildId
+    rallyId
+    balances
+    timeUpdated
     
     #################### channel_prefixes ######################
     guildId
@@ -52,12 +62,256 @@ from utils.ext import connect_db
     description
     
     #################### coin_price #################
-    date
-    price
+    timeCreated
+    priceInUSD
+    coinKind
+
+    #################### sweep_metrics #################
+    name
+    metrics
+    timeUpdated
+
+    #################### schema_migrations #################
+    version
+    timeAdded
+
+    #################### tasks_table #################
+    function
+    kwargs
+    attempts
+    runAfter
+    claimedUntil
+    timeAdded
+
+    #################### tasks_dead_letter #################
+    function
+    kwargs
+    attempts
+    error
+    timeAdded
+
+    #################### event_rollup #################
     coinKind
+    event
+    hour
+    count
+    amount
+
+    #################### change_log #################
+    tableName
+    guildId
+    timeAdded
 
 """
 
+"""
+    Indexes of the hot lookup columns, version -> [(table, columns, unique)]
+    A unique index that can't be created because of existing duplicates is created as a plain index.
+"""
+SCHEMA_INDEXES = {
+    1: [
+        (RALLY_CONNECTIONS_TABLE, [DISCORD_ID_KEY], True),
+        (BALANCE_SNAPSHOTS_TABLE, [GUILD_ID_KEY, RALLY_ID_KEY], True),
+        (ROLE_MAPPINGS_TABLE, [GUILD_ID_KEY, ROLE_NAME_KEY], True),
+        (CHANNEL_MAPPINGS_TABLE, [GUILD_ID_KEY, CHANNEL_NAME_KEY], True),
+        (CHANNEL_PREFIXES_TABLE, [GUILD_ID_KEY], True),
+        (DEFAULT_COIN_TABLE, [GUILD_ID_KEY], True),
+        (DEFAULT_COIN_TABLE, [COIN_KIND_KEY], False),
+        (CONFIG_TABLE, [GUILD_ID_KEY, CONFIG_NAME_KEY], True),
+        (CONFIG_TABLE, [CONFIG_NAME_KEY], False),
+        (USERS_TABLE, [DISCORD_ID_KEY], True),
+        (USERS_TOKEN_TABLE, [TOKEN_KEY], False),
+        (USERS_TOKEN_TABLE, [DISCORD_ID_KEY], True),
+        (COMMANDS_TABLE, [NAME_KEY], True),
+        (COIN_PRICE_TABLE, [COIN_KIND_KEY, "id"], False),
+        (BOT_INSTANCES_KEY, [GUILD_ID_KEY], True),
+        (BOT_INSTANCES_KEY, [BOT_TOKEN_KEY], True),
+        (BOT_INSTANCES_KEY, [BOT_ID_KEY], False),
+        (ALERT_SETTINGS_TABLE, [GUILD_ID_KEY], True),
+        (WEBHOOKS_TABLE, [GUILD_ID_KEY, WEBHOOK_CHANNEL_ID], True),
+        (EVENTS_TABLE, [EVENT_KEY, COIN_KIND_KEY, TIME_ADDED_KEY], False),
+        (EVENTS_TABLE, [TIME_ADDED_KEY], False),
+        (SWEEP_METRICS_TABLE, [NAME_KEY], True),
+    ],
+    2: [
+        (COIN_PRICE_TABLE, [TIME_CREATED_KEY], False),
+        (COIN_PRICE_TABLE, [COIN_KIND_KEY, TIME_CREATED_KEY], False),
+    ],
+    3: [
+        (EVENT_ROLLUP_TABLE, [COIN_KIND_KEY, HOUR_KEY], False),
+    ],
+    # version 4 is a data migration, see DATA_MIGRATIONS
+    5: [
+        (EVENT_ROLLUP_TABLE, [COIN_KIND_KEY, EVENT_KEY, HOUR_KEY], True),
+    ],
+}
+# earlier versions could be recorded while an index was only covered by another one, or
+# existed as the plain index upsert creates on its keys, so they're all checked again
+SCHEMA_INDEXES[6] = [index for indexes in SCHEMA_INDEXES.values() for index in indexes]
+
+
+def find_index(db, table_name, columns):
+    """
+    Find the index on exactly these columns, in this order.
+
+    Returns
+    _______
+
+      The index as reported by the SQLAlchemy inspector, None if there's none
+
+    """
+    for index in db.inspect.get_indexes(table_name):
+        if list(index["column_names"]) == list(columns):
+            return index
+    return None
+
+
+def create_index(db, table_name, columns, unique):
+    """
+    Create an index unless the table already has one on exactly the columns.
+
+    An index on other columns that happens to cover them doesn't count, and neither does a
+    plain index when a unique one is asked for, the plain one is replaced.
+
+    Parameters
+    __________
+
+      db (dataset.Database) - The database to create the index in
+      table_name (str) - The table to index
+      columns (list) - The indexed columns, in order
+      unique (bool) - Whether to create a unique index
+
+    Returns
+    _______
+
+      False if the table or one of the columns doesn't exist yet, True otherwise
+
+    Another process starting at the same time may create the index first, an index that
+    exists after a failed create counts as created.
+    """
+    if table_name not in db:
+        return False
+    table = db[table_name]
+    if not all(table.has_column(column) for column in columns):
+        return False
+
+    def satisfied(index):
+        return index is not None and (bool(index["unique"]) or not unique)
+
+    existing = find_index(db, table_name, columns)
+    if satisfied(existing):
+        return True
+
+    # dataset's create_index skips columns another index covers, so the index is created directly
+    indexed = [table.table.c[column] for column in columns]
+    name = index_name(table_name, columns)
+    try:
+        if existing is not None:
+            Index(existing["name"], *indexed).drop(db.executable)
+        Index(name, *indexed, unique=unique).create(db.executable)
+    except Exception as e:
+        existing = find_index(db, table_name, columns)
+        if satisfied(existing):
+            return True
+        if not unique:
+            raise
+        print(f"Can't create unique index on {table_name} {columns}, creating a plain one: {e}")
+        if existing is None:
+            try:
+                Index(name, *indexed).create(db.executable)
+            except Exception:
+                if find_index(db, table_name, columns) is None:
+                    raise
+    return True
+
+
+@connect_db
+def migrate(db):
+    """
+    Bring the database schema up to date, run at startup.
+
+    Versions of SCHEMA_INDEXES are recorded in the schema_migrations table once all of
+    their indexes exist. Tables that haven't been created yet get their indexes on a later
+    startup, after the version is recorded the version isn't checked again.
+
+    Versions of DATA_MIGRATIONS run once across all processes. The api and the bot both
+    migrate at startup, a process claims a data migration by recording its version in the
+    same transaction the migration runs in, the unique version index makes the other one
+    skip it. A migration that's still running in another process stops this startup's
+    migration, the later versions are applied on the next startup.
+    """
+    migrations = create_schema_migrations(db)
+    applied = {row[VERSION_KEY] for row in migrations.all()}
+    create_event_rollup(db)
+
+    for version in sorted(set(SCHEMA_INDEXES) | set(DATA_MIGRATIONS)):
+        if version in applied:
+            continue
+
+        if version in DATA_MIGRATIONS:
+            try:
+                with db as transaction:
+                    transaction[SCHEMA_MIGRATIONS_TABLE].insert(
+                        {VERSION_KEY: version, TIME_ADDED_KEY: time.time()}
+                    )
+                    DATA_MIGRATIONS[version](transaction)
+            except IntegrityError:
+                # another process applied it first
+                continue
+            except OperationalError as e:
+                print(f"Schema migration {version} failed or is running elsewhere, stopping: {e}")
+                return
+            print(f"Applied schema migration {version}")
+            continue
+
+        complete = True
+        for table_name, columns, unique in SCHEMA_INDEXES[version]:
+            if not create_index(db, table_name, columns, unique):
+                complete = False
+
+        if complete:
+            try:
+                migrations.insert({VERSION_KEY: version, TIME_ADDED_KEY: time.time()})
+            except IntegrityError:
+                # another process recorded it first
+                continue
+            print(f"Applied schema migration {version}")
+
+
+def create_schema_migrations(db):
+    """
+    Create the schema_migrations table with a unique index on its version.
+
+    Processes that migrated at the same time before the index existed could record a
+    version twice, all but the first row of a version are deleted before it's created.
+    """
+    migrations = db[SCHEMA_MIGRATIONS_TABLE]
+    migrations.create_column_by_example(VERSION_KEY, 0)
+    migrations.create_column_by_example(TIME_ADDED_KEY, 0.0)
+    index = find_index(db, SCHEMA_MIGRATIONS_TABLE, [VERSION_KEY])
+    if index is not None and index["unique"]:
+        return migrations
+
+    versions = migrations.table
+    first_rows = select([func.min(versions.c.id)]).group_by(versions.c[VERSION_KEY])
+    db.executable.execute(versions.delete().where(versions.c.id.notin_(first_rows)))
+    create_index(db, SCHEMA_MIGRATIONS_TABLE, [VERSION_KEY], True)
+    return migrations
+
+
+def create_event_rollup(db):
+    """Create the event_rollup table with all of its columns, so its indexes exist before the first event"""
+    rollup = db[EVENT_ROLLUP_TABLE]
+    for column, example in (
+        (COIN_KIND_KEY, ""),
+        (EVENT_KEY, ""),
+        (HOUR_KEY, 0),
+        (COUNT_KEY, 0),
+        (AMOUNT_KEY, 0.0),
+    ):
+        rollup.create_column_by_example(column, example)
+    return rollup
+
 
 @connect_db
 def add_role_coin_mapping(db, guild_id, coin, required_balance, role):
@@ -91,7 +345,7 @@ def add_channel_coin_mapping(db, guild_id, coin, required_balance, channel):
 def get_role_mappings(db, guild_id, coin=None, required_balance=None, role=None):
 
     table = db[ROLE_MAPPINGS_TABLE]
-    filtered_mappings = table.find(guildId=guild_id)
+    filtered_mappings = list(table.find(guildId=guild_id))
     if coin is not None:
         filtered_mappings = [m for m in filtered_mappings if m[COIN_KIND_KEY] == coin]
     if required_balance is not None:
@@ -107,7 +361,7 @@ def get_role_mappings(db, guild_id, coin=None, required_balance=None, role=None)
 def get_channel_mappings(db, guild_id, coin=None, required_balance=None, channel=None):
 
     table = db[CHANNEL_MAPPINGS_TABLE]
-    filtered_mappings = table.find(guildId=guild_id)
+    filtered_mappings = list(table.find(guildId=guild_id))
     if coin is not None:
         filtered_mappings = [m for m in filtered_mappings if m[COIN_KIND_KEY] == coin]
     if required_balance is not None:
@@ -158,11 +412,52 @@ def get_rally_id(db, discord_id):
     return None
 
 
+@connect_db
+def get_rally_connections(db):
+    """Bulk load every linked account as a dict of discord id -> rally id"""
+    table = db[RALLY_CONNECTIONS_TABLE]
+    return {int(row[DISCORD_ID_KEY]): row[RALLY_ID_KEY] for row in table.all()}
+
+
+@connect_db
+def get_balance_snapshots(db):
+    """
+    Bulk load the balances each guild last saw as a dict of (guild id, rally id) -> {coin: amount}
+
+    Guilds are swept on their own cadence, so every guild compares against what it saw itself.
+    Rows from before snapshots were kept per guild have no guild id and are ignored.
+    """
+    table = db[BALANCE_SNAPSHOTS_TABLE]
+    return {
+        (int(row[GUILD_ID_KEY]), row[RALLY_ID_KEY]): json.loads(row[BALANCES_KEY])
+        for row in table.all()
+        if row.get(GUILD_ID_KEY) is not None
+    }
+
+
+@connect_db
+def set_balance_snapshots(db, snapshots):
+    table = db[BALANCE_SNAPSHOTS_TABLE]
+    now = datetime.datetime.now()
+    table.upsert_many(
+        [
+            {
+                GUILD_ID_KEY: guild_id,
+                RALLY_ID_KEY: rally_id,
+                BALANCES_KEY: json.dumps(amounts),
+                TIME_UPDATED_KEY: now,
+            }
+            for (guild_id, rally_id), amounts in snapshots.items()
+        ],
+        [GUILD_ID_KEY, RALLY_ID_KEY],
+    )
+
+
 @connect_db
 def get_all_users(db):
 
     table = db[RALLY_CONNECTIONS_TABLE]
-    all_users = table.all()
+    all_users = list(table.all())
     return all_users
 
 
@@ -191,6 +486,13 @@ def get_prefix(db, guild_id):
     return None
 
 
+@connect_db
+def get_all_prefixes(db):
+    """Bulk load every custom prefix as a dict of guild id -> prefix"""
+    table = db[CHANNEL_PREFIXES_TABLE]
+    return {int(row[GUILD_ID_KEY]): row[PREFIX_KEY] for row in table.all()}
+
+
 @connect_db
 def add_default_coin(db, guild_id, coin=None):
     table = db[DEFAULT_COIN_TABLE]
@@ -257,6 +559,52 @@ def get_donate_message(db, guild_id):
     return None
 
 
+@connect_db
+def set_tiered_roles(db, guild_id, tiered):
+    table = db[CONFIG_TABLE]
+    table.upsert(
+        {
+            GUILD_ID_KEY: guild_id,
+            TIERED_ROLES_KEY: tiered,
+            CONFIG_NAME_KEY: TIERED_ROLES_KEY,
+        },
+        [GUILD_ID_KEY, CONFIG_NAME_KEY],
+    )
+
+
+@connect_db
+def get_tiered_roles(db, guild_id):
+    table = db[CONFIG_TABLE]
+    row = table.find_one(guildId=guild_id, configName=TIERED_ROLES_KEY)
+    if row is not None:
+        return row[TIERED_ROLES_KEY]
+    return False
+
+
+@connect_db
+def set_update_interval(db, guild_id, interval):
+    table = db[CONFIG_TABLE]
+    table.upsert(
+        {
+            GUILD_ID_KEY: guild_id,
+            UPDATE_INTERVAL_KEY: interval,
+            CONFIG_NAME_KEY: UPDATE_INTERVAL_KEY,
+        },
+        [GUILD_ID_KEY, CONFIG_NAME_KEY],
+    )
+
+
+@connect_db
+def get_update_intervals(db):
+    """Bulk load the update intervals set by guild admins as a dict of guild id -> seconds"""
+    table = db[CONFIG_TABLE]
+    return {
+        int(row[GUILD_ID_KEY]): row[UPDATE_INTERVAL_KEY]
+        for row in table.find(configName=UPDATE_INTERVAL_KEY)
+        if row[UPDATE_INTERVAL_KEY]
+    }
+
+
 @connect_db
 def add_user(db, discord_id, username, discriminator, guilds):
     table = db[USERS_TABLE]
@@ -321,7 +669,7 @@ def add_command(db, name, description):
 @connect_db
 def get_all_commands(db):
     table = db[COMMANDS_TABLE]
-    return table.all()
+    return list(table.all())
 
 
 @connect_db
@@ -344,29 +692,46 @@ def add_coin_price(db, price, coin):
 
 @connect_db
 def add_coin_price_multiple(db, prices):
-    table = db[COIN_PRICE_TABLE]
-    table.insert_many(prices)
+    insert_many(db, db[COIN_PRICE_TABLE], prices)
 
 
 @connect_db
-def clean_price_cache(db, limit):
-    table = db[COIN_PRICE_TABLE]
-    old = table.all(order_by="id", _limit=limit)
-    for price in old:
-        table.delete(id=price["id"])
+def delete_old_coin_prices(db, before, coin=None, exclude=()):
+    """
+    Delete the coin prices created before a time in a single statement.
 
+    Parameters
+    __________
 
-@connect_db
-def price_count(db):
+      before (datetime.datetime) - Prices created before this are deleted
+      coin (str) - Only delete the prices of this coin
+      exclude (list) - Coins whose prices are kept
+
+    Returns
+    _______
+
+      Number of deleted rows
+
+    """
     table = db[COIN_PRICE_TABLE]
-    return table.__len__()
+    if not table.exists:
+        return 0
+
+    prices = table.table
+    condition = prices.c[TIME_CREATED_KEY] < before
+    if coin is not None:
+        condition = and_(condition, prices.c[COIN_KIND_KEY] == coin)
+    if exclude:
+        condition = and_(condition, prices.c[COIN_KIND_KEY].notin_(exclude))
+
+    return db.executable.execute(prices.delete().where(condition)).rowcount
 
 
 @connect_db
 def get_coin_prices(db, coin, limit):
     limit = limit or 24
     table = db[COIN_PRICE_TABLE]
-    return table.find(coinKind=coin, order_by="-id", _limit=limit)
+    return list(table.find(coinKind=coin, order_by="-id", _limit=limit))
 
 
 @connect_db
@@ -426,7 +791,7 @@ def set_bot_id(db, bot_id, bot_instance):
 @connect_db
 def add_bot_instance(db, guild_id, bot_instance):
     table = db[BOT_INSTANCES_KEY]
-    table.insert(
+    table.upsert(
         {
             GUILD_ID_KEY: guild_id,
             BOT_TOKEN_KEY: bot_instance,
@@ -437,7 +802,8 @@ def add_bot_instance(db, guild_id, bot_instance):
             NAME_TIMEOUT_KEY: 0,
             BOT_ACTIVITY_TYPE_KEY: "",
             BOT_ACTIVITY_TEXT_KEY: "",
-        }
+        },
+        [GUILD_ID_KEY],
     )
 
 
@@ -584,36 +950,173 @@ def get_all_timers(db, bot_id):
 
 
 @connect_db
-def add_event(db, event, coin):
+def add_event(db, event, coin, amount=0.0):
+    now = time.time()
     table = db[EVENTS_TABLE]
     table.insert({
         EVENT_KEY: event,
         COIN_KIND_KEY: coin,
-        TIME_ADDED_KEY: time.time()
+        AMOUNT_KEY: float(amount),
+        TIME_ADDED_KEY: now
     })
+    add_to_event_rollup(db, event, coin, event_hour(now), 1, float(amount))
+
+
+def event_hour(timestamp):
+    """Start of the event_rollup bucket a timestamp falls in"""
+    return int(timestamp // EVENT_ROLLUP_BUCKET) * EVENT_ROLLUP_BUCKET
+
+
+def add_to_event_rollup(db, event, coin, hour, count, amount):
+    """
+    Add events to their hourly bucket in the event_rollup table.
+
+    The bucket is incremented in a single update, it's only inserted if the update found
+    no bucket. When another process inserts the same new bucket first, the unique bucket
+    index rejects the insert and the update is run again.
+    """
+    rollup = db[EVENT_ROLLUP_TABLE]
+    if not rollup.exists:
+        rollup = create_event_rollup(db)
+
+    buckets = rollup.table
+    increment = (
+        buckets.update()
+        .where(
+            and_(
+                buckets.c[COIN_KIND_KEY] == coin,
+                buckets.c[EVENT_KEY] == event,
+                buckets.c[HOUR_KEY] == hour,
+            )
+        )
+        .values(
+            {
+                COUNT_KEY: buckets.c[COUNT_KEY] + count,
+                AMOUNT_KEY: buckets.c[AMOUNT_KEY] + amount,
+            }
+        )
+    )
+    if db.executable.execute(increment).rowcount:
+        return
+
+    try:
+        rollup.insert(
+            {
+                COIN_KIND_KEY: coin,
+                EVENT_KEY: event,
+                HOUR_KEY: hour,
+                COUNT_KEY: count,
+                AMOUNT_KEY: amount,
+            }
+        )
+    except IntegrityError:
+        db.executable.execute(increment)
+
+
+def rebuild_event_rollup(db):
+    """
+    Rebuild the event_rollup table from the stored events, run once as a data migration.
+
+    Covers the events stored before the rollup existed and merges the duplicate buckets
+    concurrent inserts could create before the bucket index was unique.
+    """
+    totals = Counter()
+    amounts = Counter()
+    for row in db[EVENTS_TABLE].all():
+        bucket = (row[EVENT_KEY], row[COIN_KIND_KEY], event_hour(row[TIME_ADDED_KEY]))
+        totals[bucket] += 1
+        amounts[bucket] += row.get(AMOUNT_KEY) or 0.0
+
+    rollup = db[EVENT_ROLLUP_TABLE]
+    rollup.delete()
+    insert_many(
+        db,
+        rollup,
+        [
+            {
+                COIN_KIND_KEY: coin,
+                EVENT_KEY: event,
+                HOUR_KEY: hour,
+                COUNT_KEY: count,
+                AMOUNT_KEY: amounts[(event, coin, hour)],
+            }
+            for (event, coin, hour), count in totals.items()
+        ],
+    )
+    print(f"Rebuilt {len(totals)} event rollup buckets")
 
 
-@connect_db
-def get_day_events(db, event, coin):
-    table = db[EVENTS_TABLE]
-    ago_24h = time.time() - (24 * 3600)
-    return [r for r in table.find(event=event, coinKind=coin, timeAdded={'gt': ago_24h})]
+"""
+    Migrations that change data, version -> function called with the database in a transaction.
+    They share their version numbers with SCHEMA_INDEXES.
+"""
+DATA_MIGRATIONS = {
+    4: rebuild_event_rollup,
+}
 
 
 @connect_db
-def get_week_events(db, event, coin):
-    table = db[EVENTS_TABLE]
-    ago_1week = time.time() - (7 * 24 * 3600)
-    return [r for r in table.find(coinKind=coin, event=event, timeAdded={'gt': ago_1week})]
+def get_event_stats(db, coin, since):
+    """
+    Count and sum the events of a coin since a time in one grouped query over the hourly
+    rollup, the window starts at the beginning of the hour since falls in.
+
+    Parameters
+    __________
+
+      coin (str) - Coin symbol
+      since (float) - Epoch time the window starts at
+
+    Returns
+    _______
+
+      dict of event -> {"count": int, "amount": float}
+
+    """
+    rollup = db[EVENT_ROLLUP_TABLE]
+    if not rollup.exists:
+        return {}
+
+    buckets = rollup.table
+    query = (
+        select(
+            [
+                buckets.c[EVENT_KEY],
+                func.sum(buckets.c[COUNT_KEY]),
+                func.sum(buckets.c[AMOUNT_KEY]),
+            ]
+        )
+        .where(
+            and_(
+                buckets.c[COIN_KIND_KEY] == coin,
+                buckets.c[HOUR_KEY] >= event_hour(since),
+            )
+        )
+        .group_by(buckets.c[EVENT_KEY])
+    )
+    return {
+        event: {"count": int(count or 0), "amount": float(amount or 0)}
+        for event, count, amount in db.executable.execute(query)
+    }
 
 
 @connect_db
 def delete_week_old_events(db):
-    table = db[EVENTS_TABLE]
     ago_1week = time.time() - (7 * 24 * 3600)
-    week_old = table.find(timeAdded={'lt': ago_1week})
-    for event in week_old:
-        table.delete(id=event['id'])
+
+    table = db[EVENTS_TABLE]
+    if table.exists:
+        events = table.table
+        db.executable.execute(
+            events.delete().where(events.c[TIME_ADDED_KEY] < ago_1week)
+        )
+
+    rollup = db[EVENT_ROLLUP_TABLE]
+    if rollup.exists:
+        buckets = rollup.table
+        db.executable.execute(
+            buckets.delete().where(buckets.c[HOUR_KEY] < event_hour(ago_1week))
+        )
 
 
 @connect_db
@@ -625,7 +1128,18 @@ def get_guilds_by_coin(db, coin):
 @connect_db
 def add_task(db, task):
     table = db[TASKS_TABLE]
-    return table.insert(task)
+    task_id = table.insert(
+        {
+            **task,
+            ATTEMPTS_KEY: 0,
+            RUN_AFTER_KEY: 0.0,
+            CLAIMED_UNTIL_KEY: 0.0,
+            TIME_ADDED_KEY: time.time(),
+        }
+    )
+    # wakes up the bot's task queue
+    notify_change(TASKS_TABLE, None)
+    return task_id
 
 
 @connect_db
@@ -635,6 +1149,188 @@ def delete_task(db, task_id):
 
 
 @connect_db
-def get_tasks(db):
+def claim_tasks(db, limit, lease):
+    """
+    Claim up to limit due tasks that aren't claimed by anyone else, oldest first.
+
+    A claim expires after lease seconds, so the tasks of a worker that died while
+    running them are picked up again. On Postgres the tasks are claimed in one
+    statement that skips rows other transactions are claiming. On other databases
+    each task is claimed with an update that only matches while it's still unclaimed.
+
+    Parameters
+    __________
+
+      limit (int) - Maximum number of tasks to claim
+      lease (int) - Seconds the tasks stay claimed
+
+    Returns
+    _______
+
+      list of task dicts
+
+    """
+    table = db[TASKS_TABLE]
+    if not table.exists:
+        return []
+
+    # tasks added before retries existed don't have these columns yet
+    for column, example in (
+        (ATTEMPTS_KEY, 0),
+        (RUN_AFTER_KEY, 0.0),
+        (CLAIMED_UNTIL_KEY, 0.0),
+        (TIME_ADDED_KEY, 0.0),
+    ):
+        table.create_column_by_example(column, example)
+
+    tasks = table.table
+    now = time.time()
+    claimable = and_(
+        or_(tasks.c[RUN_AFTER_KEY] == None, tasks.c[RUN_AFTER_KEY] <= now),
+        or_(tasks.c[CLAIMED_UNTIL_KEY] == None, tasks.c[CLAIMED_UNTIL_KEY] < now),
+    )
+
+    if db.engine.dialect.name == "postgresql":
+        due = (
+            select([tasks.c.id])
+            .where(claimable)
+            .order_by(tasks.c.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        claim = (
+            tasks.update()
+            .where(tasks.c.id.in_(due))
+            .values({CLAIMED_UNTIL_KEY: now + lease})
+            .returning(*tasks.c)
+        )
+        with db as transaction:
+            rows = transaction.executable.execute(claim).fetchall()
+        return sorted((dict(row) for row in rows), key=lambda task: task["id"])
+
+    due = tasks.select().where(claimable).order_by(tasks.c.id).limit(limit)
+    claimed = []
+    for row in db.executable.execute(due).fetchall():
+        claim = (
+            tasks.update()
+            .where(and_(tasks.c.id == row["id"], claimable))
+            .values({CLAIMED_UNTIL_KEY: now + lease})
+        )
+        if db.executable.execute(claim).rowcount == 1:
+            claimed.append(dict(row))
+    return claimed
+
+
+@connect_db
+def fail_task(db, task, error, retry_in):
+    """
+    Record a failed run of a claimed task.
+
+    Parameters
+    __________
+
+      task (dict) - The task as returned by claim_tasks
+      error (str) - What went wrong
+      retry_in (float) - Seconds until the task is run again, None moves it to the dead letter table
+
+    """
+    attempts = (task.get(ATTEMPTS_KEY) or 0) + 1
+
     table = db[TASKS_TABLE]
-    return [t for t in table.all()]
+    if retry_in is None:
+        db[TASKS_DEAD_LETTER_TABLE].insert(
+            {
+                "function": task["function"],
+                "kwargs": task["kwargs"],
+                ATTEMPTS_KEY: attempts,
+                ERROR_KEY: error,
+                TIME_ADDED_KEY: time.time(),
+            }
+        )
+        table.delete(id=task["id"])
+        return
+
+    table.update(
+        {
+            "id": task["id"],
+            ATTEMPTS_KEY: attempts,
+            RUN_AFTER_KEY: time.time() + retry_in,
+            CLAIMED_UNTIL_KEY: 0,
+        },
+        ["id"],
+    )
+
+
+@connect_db
+def set_sweep_metrics(db, metrics):
+    table = db[SWEEP_METRICS_TABLE]
+    table.upsert(
+        {
+            NAME_KEY: METRICS_ROW_NAME,
+            METRICS_KEY: metrics,
+            TIME_UPDATED_KEY: datetime.datetime.now(),
+        },
+        [NAME_KEY],
+    )
+
+
+@connect_db
+def notify_change(db, table_name, guild_id):
+    """
+    Tell the bot process that a guild's rows in a table were changed.
+
+    On Postgres the change is sent with NOTIFY on CHANGE_FEED_CHANNEL, on other
+    databases it's appended to the change_log table, which the bot polls.
+    """
+    if guild_id is not None:
+        guild_id = int(guild_id)
+
+    if db.engine.dialect.name == "postgresql":
+        payload = json.dumps({TABLE_NAME_KEY: table_name, GUILD_ID_KEY: guild_id})
+        # notifications are only delivered once the transaction commits
+        with db as transaction:
+            transaction.query(
+                "SELECT pg_notify(:channel, :payload)",
+                channel=CHANGE_FEED_CHANNEL,
+                payload=payload,
+            )
+        return
+
+    table = db[CHANGE_LOG_TABLE]
+    table.insert(
+        {
+            TABLE_NAME_KEY: table_name,
+            GUILD_ID_KEY: guild_id,
+            TIME_ADDED_KEY: time.time(),
+        }
+    )
+
+
+@connect_db
+def get_changes(db, after_id):
+    table = db[CHANGE_LOG_TABLE]
+    return [row for row in table.find(id={'gt': after_id}, order_by="id")]
+
+
+@connect_db
+def get_last_change_id(db):
+    table = db[CHANGE_LOG_TABLE]
+    row = table.find_one(order_by="-id")
+    if row is not None:
+        return row["id"]
+    return 0
+
+
+@connect_db
+def delete_old_changes(db, before):
+    table = db[CHANGE_LOG_TABLE]
+    table.delete(timeAdded={'lt': before})
+
+
+@connect_db
+def get_sweep_metrics(db):
+    table = db[SWEEP_METRICS_TABLE]
+    row = table.find_one(name=METRICS_ROW_NAME)
+    if row is not None:
+        return row[METRICS_KEY]
+    return None
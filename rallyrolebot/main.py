@@ -1,11 +1,15 @@
 import discord
 import config
 import data
+import rally_api
 import os
 import asyncio
 
 from constants import *
 from utils.timers import Timers
+from utils.ext import run_db
+from utils.prefix_cache import prefix_cache
+from utils.change_feed import change_feed
 from discord.ext import commands
 
 config.parse_args()
@@ -20,10 +24,9 @@ running_bot_instances = []
 
 
 def prefix(_, ctx):
-    try:
-        return data.get_prefix(ctx.guild.id) or default_prefix
-    except:
+    if not ctx.guild:
         return default_prefix
+    return prefix_cache.get(ctx.guild.id) or default_prefix
 
 
 class RallyRoleBot(commands.Bot):
@@ -67,7 +70,7 @@ class RallyRoleBot(commands.Bot):
     async def run_bot_instances(self) -> None:
         """Start up all the bot instances."""
         # get all bot instances
-        all_bot_instances = data.get_all_bot_instances()
+        all_bot_instances = await run_db(data.get_all_bot_instances)
         if all_bot_instances:
             for instance in all_bot_instances:
                 # add bot token to list of running bot instances
@@ -78,10 +81,17 @@ class RallyRoleBot(commands.Bot):
     async def close(self):
         await super().close()
 
+        # the rally connection pool is shared by every instance, only the main bot closes it
+        if main_bot is self:
+            await rally_api.close_session()
+
     def run(self):
         super().run(config.CONFIG.secret_token, reconnect=True)
 
 
 if __name__ == "__main__":
+    data.migrate()
+    prefix_cache.warm()
+    change_feed.subscribe(CHANNEL_PREFIXES_TABLE, prefix_cache.refresh)
     bot = RallyRoleBot()
     bot.run()
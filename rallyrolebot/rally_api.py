@@ -1,3 +1,7 @@
+import asyncio
+import time
+
+import aiohttp
 import requests
 
 from constants import *
@@ -22,6 +26,156 @@ def get_balances(rally_id):
     return result.json()
 
 
+"""
+    Async client used by the discord bot. All requests share one keep-alive
+    connection pool and are bounded by a semaphore, so the event loop is
+    never blocked and the number of in-flight requests stays constant
+    no matter how many members are being checked.
+"""
+
+_session = None
+_request_semaphore = None
+
+
+def _get_session():
+    global _session, _request_semaphore
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=RALLY_POOL_SIZE, keepalive_timeout=RALLY_KEEPALIVE_TIMEOUT
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=RALLY_REQUEST_TIMEOUT),
+        )
+        _request_semaphore = asyncio.Semaphore(RALLY_MAX_IN_FLIGHT)
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def fetch_json(url):
+    """
+    GET a rally api url through the shared connection pool.
+
+    Server errors, timeouts and connection errors are retried with an
+    exponential backoff, client errors are not.
+
+    Returns
+    _______
+
+      The decoded json body, or None if the request failed
+    """
+    session = _get_session()
+    for attempt in range(RALLY_MAX_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(RALLY_RETRY_BACKOFF * 2 ** (attempt - 1))
+        try:
+            async with _request_semaphore:
+                async with session.get(url) as result:
+                    if result.status == 200:
+                        return await result.json()
+
+                    print("Request error!")
+                    print(f"Url: {url}")
+                    print(f"Status Code: {result.status}")
+                    if result.status < 500 and result.status != 429:
+                        return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Request to {url} failed: {e!r}")
+    return None
+
+
+async def fetch_balances(rally_id):
+    url = BASE_URL + "/users/rally/" + rally_id + "/balance"
+    return await fetch_json(url)
+
+
+class BalanceCache:
+    """
+    Cache of rally balances keyed by rally id.
+
+    A sweep calls new_cycle() before it starts and end_cycle() when it's done, every
+    balance fetched in between is reused for the rest of the cycle, so a wallet linked
+    to members of many guilds is fetched only once per sweep. Outside of a cycle,
+    entries are reused while they are younger than the ttl. Concurrent lookups of the same rally id
+    share a single request.
+    """
+
+    def __init__(self, ttl=BALANCE_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._pending = {}
+        self._cycle_start = None
+
+    def new_cycle(self):
+        """Start a new sweep cycle, resets the counters and drops expired entries."""
+        now = time.monotonic()
+        self._cycle_start = now
+        self.hits = 0
+        self.misses = 0
+        self._entries = {
+            rally_id: entry
+            for rally_id, entry in self._entries.items()
+            if now - entry[0] <= self.ttl
+        }
+
+    def end_cycle(self):
+        self._cycle_start = None
+
+    def invalidate(self, rally_id):
+        self._entries.pop(rally_id, None)
+
+    async def get(self, rally_id, max_age=None):
+        """
+        Get the balances of a rally id, fetching them if there's no usable entry.
+
+        Parameters
+        __________
+
+          rally_id (str) - The rally id to look up
+          max_age (float) - Maximum age in seconds of an entry not fetched in the current cycle,
+                            defaults to the cache ttl. 0 only reuses balances fetched this cycle.
+
+        """
+        max_age = self.ttl if max_age is None else max_age
+
+        entry = self._entries.get(rally_id)
+        if entry is not None:
+            fetched, balances = entry
+            in_cycle = self._cycle_start is not None and fetched >= self._cycle_start
+            if in_cycle or time.monotonic() - fetched <= max_age:
+                self.hits += 1
+                return balances
+
+        pending = self._pending.get(rally_id)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_event_loop().create_future()
+        self._pending[rally_id] = future
+        balances = None
+        try:
+            balances = await fetch_balances(rally_id)
+            if balances is not None:
+                self._entries[rally_id] = (time.monotonic(), balances)
+        finally:
+            del self._pending[rally_id]
+            future.set_result(balances)
+        return balances
+
+
+balance_cache = BalanceCache()
+
+
 def get_balance_of_coin(rally_id, coin_name):
     balances = get_balances(rally_id)
     if balances is None:
@@ -35,6 +189,7 @@ def find_balance_of_coin(coin_name, balances):
     for coin_balance in balances:
         if coin_balance[COIN_KIND_KEY] == coin_name:
             return float(coin_balance[COIN_BALANCE_KEY])
+    return 0.0
 
 
 def valid_coin_symbol(coin_name):
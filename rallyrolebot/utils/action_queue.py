@@ -0,0 +1,229 @@
+import asyncio
+import itertools
+import time
+
+from collections import deque
+from heapq import heappush, heappop
+from constants import *
+
+
+class TokenBucket:
+    """Token bucket refilled at rate tokens per second, holding at most capacity tokens."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Seconds until a token is available, 0 if one is available now."""
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class Action:
+    def __init__(self, function, priority, future):
+        self.function = function
+        self.priority = priority
+        self.future = future
+        self.queued = time.monotonic()
+
+
+class ActionQueue:
+    """
+    Central queue for the role and permission writes the update cog sends to Discord.
+
+    Writes are spread over token buckets per (guild, route), so a large guild can't
+    use up the bot's rate limits and stall everything else. User triggered actions go
+    before sweep actions. An action submitted for a member while an older one for the
+    same member and route is still waiting replaces it, only the newest desired state
+    is written.
+    """
+
+    def __init__(self, workers=ACTION_QUEUE_WORKERS):
+        self.workers = workers
+        self.executed = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.wait_times = {
+            ACTION_PRIORITY_USER: deque(maxlen=ACTION_WAIT_SAMPLES),
+            ACTION_PRIORITY_SWEEP: deque(maxlen=ACTION_WAIT_SAMPLES),
+        }
+
+        self._heap = []
+        self._actions = {}
+        self._buckets = {}
+        self._sequence = itertools.count()
+        self._wakeup = None
+        self._worker_tasks = []
+
+    def __len__(self):
+        return len(self._actions)
+
+    def is_pending(self, guild_id, route, target_id):
+        return (guild_id, route, target_id) in self._actions
+
+    def pending_targets(self, guild_id, route):
+        """Ids of the targets with a queued action on a route of a guild."""
+        return {
+            target_id
+            for action_guild_id, action_route, target_id in self._actions
+            if action_guild_id == guild_id and action_route == route
+        }
+
+    def _start(self):
+        if self._worker_tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._worker_tasks = [
+            asyncio.ensure_future(self._worker()) for _ in range(self.workers)
+        ]
+
+    def _bucket(self, key):
+        guild_id, route, _ = key
+        bucket = self._buckets.get((guild_id, route))
+        if bucket is None:
+            rate, capacity = ACTION_RATE_LIMITS[route]
+            bucket = TokenBucket(rate, capacity)
+            self._buckets[(guild_id, route)] = bucket
+        return bucket
+
+    def submit(self, guild_id, route, target_id, function, priority=ACTION_PRIORITY_SWEEP):
+        """
+        Queue a Discord write.
+
+        Parameters
+        __________
+
+          guild_id (int) - Guild the write belongs to
+          route (str) - One of the routes in ACTION_RATE_LIMITS
+          target_id - What the write changes, pending writes with the same guild, route
+                      and target are coalesced. None never coalesces.
+          function (callable) - Coroutine function making the request
+          priority (int) - ACTION_PRIORITY_USER or ACTION_PRIORITY_SWEEP
+
+        Returns
+        _______
+
+          asyncio.Future resolved with the result of the write
+
+        """
+        self._start()
+
+        if target_id is None:
+            target_id = ("unique", next(self._sequence))
+        key = (guild_id, route, target_id)
+
+        action = self._actions.get(key)
+        if action is not None:
+            action.function = function
+            self.coalesced += 1
+            if priority < action.priority:
+                action.priority = priority
+                heappush(self._heap, (priority, next(self._sequence), key))
+                self._wakeup.set()
+            return action.future
+
+        action = Action(function, priority, asyncio.get_event_loop().create_future())
+        self._actions[key] = action
+        heappush(self._heap, (priority, next(self._sequence), key))
+        self._wakeup.set()
+        return action.future
+
+    async def run(self, guild_id, route, target_id, function, priority=ACTION_PRIORITY_SWEEP):
+        """Submit a write and wait for it to be made."""
+        return await asyncio.shield(
+            self.submit(guild_id, route, target_id, function, priority)
+        )
+
+    async def _next_ready(self):
+        """Wait for the highest priority action whose bucket has a token and take it off the queue."""
+        while True:
+            delayed = []
+            wait = None
+            ready = None
+
+            while self._heap:
+                priority, sequence, key = heappop(self._heap)
+                action = self._actions.get(key)
+                # stale entry of an action that was already run or had its priority raised
+                if action is None or action.priority != priority:
+                    continue
+
+                bucket = self._bucket(key)
+                delay = bucket.delay()
+                if delay == 0:
+                    bucket.take()
+                    ready = key
+                    break
+
+                delayed.append((priority, sequence, key))
+                wait = delay if wait is None else min(wait, delay)
+
+            for entry in delayed:
+                heappush(self._heap, entry)
+            if ready is not None:
+                return ready, self._actions.pop(ready)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            key, action = await self._next_ready()
+
+            self.wait_times[action.priority].append(time.monotonic() - action.queued)
+
+            try:
+                result = await action.function()
+            except Exception as e:
+                self.failed += 1
+                if not action.future.done():
+                    action.future.set_exception(e)
+            else:
+                self.executed += 1
+                if not action.future.done():
+                    action.future.set_result(result)
+
+    def stats(self):
+        """Queue depth, counters and recent wait times in seconds per priority."""
+        depth = {ACTION_PRIORITY_USER: 0, ACTION_PRIORITY_SWEEP: 0}
+        for action in self._actions.values():
+            depth[action.priority] += 1
+
+        stats = {
+            "depth": len(self._actions),
+            "depth_user": depth[ACTION_PRIORITY_USER],
+            "depth_sweep": depth[ACTION_PRIORITY_SWEEP],
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+        }
+        for priority, name in (
+            (ACTION_PRIORITY_USER, "user"),
+            (ACTION_PRIORITY_SWEEP, "sweep"),
+        ):
+            wait_times = self.wait_times[priority]
+            stats[f"wait_avg_{name}"] = (
+                sum(wait_times) / len(wait_times) if wait_times else 0.0
+            )
+            stats[f"wait_max_{name}"] = max(wait_times) if wait_times else 0.0
+        return stats
+
+
+action_queue = ActionQueue()
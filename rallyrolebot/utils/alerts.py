@@ -5,8 +5,10 @@ import main
 import discord
 import sys
 import requests
+import time
 
 from cogs.update_cog import default_avatar
+from utils.ext import run_db
 from constants import *
 from typing import Optional
 
@@ -98,7 +100,7 @@ async def get_webhook_url(guild_id: str, channel_name: str) -> Optional[str]:
     @return: webhook url or None if error occurred
     """
     # get bot object
-    bot_instance = data.get_bot_instance(guild_id)
+    bot_instance = await run_db(data.get_bot_instance, guild_id)
     bot_object = main.main_bot if not bot_instance else main.running_bots[bot_instance[BOT_ID_KEY]]['bot']
 
     # wait until bot is ready, just in case
@@ -117,12 +119,19 @@ async def get_webhook_url(guild_id: str, channel_name: str) -> Optional[str]:
         return
 
     # get webhook
-    webhook = data.get_webhook(guild_id, channel_object.id)
+    webhook = await run_db(data.get_webhook, guild_id, channel_object.id)
     if not webhook:
         # if webhook doesnt exist, create new one and add it to the webhooks database
         try:
             webhook_object = await channel_object.create_webhook(name='RallyBotAlerts', avatar=default_avatar)
-            data.add_webhook(guild_id, channel_object.id, webhook_object.url, webhook_object.id, webhook_object.token)
+            await run_db(
+                data.add_webhook,
+                guild_id,
+                channel_object.id,
+                webhook_object.url,
+                webhook_object.id,
+                webhook_object.token,
+            )
             webhook_url = webhook_object.url
         except:
             return
@@ -140,17 +149,23 @@ async def process_payload(payload: dict, failed: bool = False) -> None:
     @param failed: True if failed to send message to webhook, False on first attempt
     @return: None
     """
-    # add to stats
     coin_kind = payload['coinKind']
     event = payload['event'].lower()
-    data.add_event(event, coin_kind)
+
+    # add to stats, only once if the payload is processed again after a failed webhook
+    if not failed:
+        try:
+            amount = float(payload['data']['amountOfCoin'] if event != 'convert' else payload['data']['fromAmount'])
+        except (KeyError, TypeError, ValueError):
+            amount = 0.0
+        await run_db(data.add_event, event, coin_kind, amount)
 
     # find guilds that have coin_kind as default coin and loop through them
-    guilds = data.get_guilds_by_coin(coin_kind)
+    guilds = await run_db(data.get_guilds_by_coin, coin_kind)
     for guild in guilds:
         guild_id = guild[GUILD_ID_KEY]
         # get alert settings
-        alerts_settings = data.get_alerts_settings(guild_id)
+        alerts_settings = await run_db(data.get_alerts_settings, guild_id)
         if not alerts_settings:
             continue
 
@@ -190,37 +205,40 @@ async def process_payload(payload: dict, failed: bool = False) -> None:
 
                 # request failed, delete webhook db entry and try again, if it fails a second time dont try again
                 if request.status_code not in [200, 204] and not failed:
-                    data.delete_webhook(webhook_url)
+                    await run_db(data.delete_webhook, webhook_url)
                     return await process_payload(payload, True)
 
 
-def get_day_stats(coin: str) -> dict:
+async def get_event_stats(coin: str, seconds: int) -> dict:
     """
-    Return dict of stats of events in the past 24h
+    Return dict of the count and summed coin amount of each event type in a time window
 
     @param coin: con symbol e.g. "STANZ"
-    @return: stats dict
+    @param seconds: length of the window ending now
+    @return: stats dict, event type -> {'count': int, 'amount': float}
     """
+    stats = await run_db(data.get_event_stats, coin, time.time() - seconds) or {}
     return {
-        'buy': data.get_day_events('buy', coin),
-        'donate': data.get_day_events('donate', coin),
-        'transfer': data.get_day_events('transfer', coin),
-        'convert': data.get_day_events('convert', coin),
-        'redeem': data.get_day_events('redeem', coin),
+        event: stats.get(event, {'count': 0, 'amount': 0.0})
+        for event in ('buy', 'donate', 'transfer', 'convert', 'redeem')
     }
 
 
-def get_week_stats(coin: str) -> dict:
+async def get_day_stats(coin: str) -> dict:
+    """
+    Return dict of stats of events in the past 24h
+
+    @param coin: con symbol e.g. "STANZ"
+    @return: stats dict
+    """
+    return await get_event_stats(coin, 24 * 3600)
+
+
+async def get_week_stats(coin: str) -> dict:
     """
     Return dict of stats of events in the past week
 
     @param coin: con symbol e.g. "STANZ"
     @return: stats dict
     """
-    return {
-        'buy': data.get_week_events('buy', coin),
-        'donate': data.get_week_events('donate', coin),
-        'transfer': data.get_week_events('transfer', coin),
-        'convert': data.get_week_events('convert', coin),
-        'redeem': data.get_week_events('redeem', coin),
-    }
+    return await get_event_stats(coin, 7 * 24 * 3600)
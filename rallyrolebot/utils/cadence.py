@@ -0,0 +1,63 @@
+import time
+
+from collections import Counter
+
+from constants import *
+
+
+class GuildCadence:
+    """
+    Per guild update schedule adapted to how often updates actually change something.
+
+    A guild whose update changed nothing has its interval multiplied by
+    CADENCE_BACKOFF_FACTOR, one whose update changed at least CADENCE_VOLATILE_RATIO
+    of the checked members has it divided by CADENCE_SPEEDUP_FACTOR, always staying
+    within CADENCE_MIN_INTERVAL and CADENCE_MAX_INTERVAL. An interval set by the
+    guild's admins replaces the adaptive one.
+    """
+
+    def __init__(self):
+        self.intervals = {}
+        self.last_update = {}
+        self.update_counts = Counter()
+
+    def interval(self, guild_id, override=None):
+        """Seconds between updates of a guild, override is the interval set by its admins."""
+        if override:
+            # stored overrides are clamped too, a negative or tiny one would update the guild every tick
+            return min(max(override, CADENCE_MIN_INTERVAL), CADENCE_MAX_INTERVAL)
+        return self.intervals.get(guild_id, UPDATE_WAIT_TIME)
+
+    def is_due(self, guild_id, override=None):
+        last_update = self.last_update.get(guild_id)
+        if last_update is None:
+            return True
+        return time.monotonic() - last_update >= self.interval(guild_id, override)
+
+    def is_full_reconcile(self, guild_id):
+        """Every n-th update of a guild checks all members, not only those whose balance crossed a threshold."""
+        return self.update_counts[guild_id] % SNAPSHOT_FULL_RECONCILE_INTERVAL == 0
+
+    def record(self, guild_id, checked, changed):
+        """
+        Record a finished update of a guild and adapt its interval.
+
+        Parameters
+        __________
+
+          guild_id (int) - The updated guild
+          checked (int) - Number of members whose balances were checked
+          changed (int) - Number of role edits and overwrite changes the update made
+
+        """
+        interval = self.intervals.get(guild_id, UPDATE_WAIT_TIME)
+        if not changed:
+            interval *= CADENCE_BACKOFF_FACTOR
+        elif checked and changed / checked >= CADENCE_VOLATILE_RATIO:
+            interval /= CADENCE_SPEEDUP_FACTOR
+
+        self.intervals[guild_id] = min(
+            CADENCE_MAX_INTERVAL, max(CADENCE_MIN_INTERVAL, interval)
+        )
+        self.last_update[guild_id] = time.monotonic()
+        self.update_counts[guild_id] += 1
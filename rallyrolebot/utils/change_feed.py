@@ -0,0 +1,125 @@
+import asyncio
+import json
+import time
+import data
+
+from collections import defaultdict
+from constants import *
+from utils.ext import get_db, run_db
+
+
+class ChangeFeed:
+    """
+    Receives the changes the api process makes to the database, so caches in the bot
+    process can be kept for long and still be invalidated within a second of an edit.
+
+    The api calls data.notify_change(table, guild_id) after every mutation. On Postgres
+    the changes arrive as notifications on a LISTEN connection, on other databases the
+    change_log table is polled every CHANGE_FEED_POLL_INTERVAL seconds. Subscribers are
+    called with the guild id of the change, or None when changes may have been missed
+    and everything they cached from the table has to be reloaded.
+    """
+
+    def __init__(self):
+        self.received = 0
+        self._subscribers = defaultdict(list)
+        self._task = None
+
+    def subscribe(self, table_name, callback):
+        """
+        Call a coroutine function whenever a table is changed.
+
+        Parameters
+        __________
+
+          table_name (str) - The changed table
+          callback (callable) - Coroutine function taking the changed guild's id
+
+        """
+        self._subscribers[table_name].append(callback)
+
+    def start(self):
+        if self._task:
+            return
+
+        if get_db().engine.dialect.name == "postgresql":
+            self._task = asyncio.ensure_future(self._listen())
+        else:
+            self._task = asyncio.ensure_future(self._poll())
+
+    async def dispatch(self, table_name, guild_id):
+        self.received += 1
+        for callback in self._subscribers.get(table_name, []):
+            try:
+                await callback(guild_id)
+            except Exception as e:
+                print(f"Failed to handle a change of {table_name}: {e!r}")
+
+    async def dispatch_all(self):
+        for table_name in list(self._subscribers):
+            await self.dispatch(table_name, None)
+
+    async def _poll(self):
+        last_id = await run_db(data.get_last_change_id) or 0
+        last_cleanup = time.monotonic()
+
+        while True:
+            await asyncio.sleep(CHANGE_FEED_POLL_INTERVAL)
+
+            for change in await run_db(data.get_changes, last_id) or []:
+                last_id = change["id"]
+                await self.dispatch(change[TABLE_NAME_KEY], change[GUILD_ID_KEY])
+
+            if time.monotonic() - last_cleanup >= CHANGE_FEED_RETENTION:
+                last_cleanup = time.monotonic()
+                await run_db(
+                    data.delete_old_changes, time.time() - CHANGE_FEED_RETENTION
+                )
+
+    async def _listen(self):
+        while True:
+            try:
+                await self._listen_connection()
+            except Exception as e:
+                print(f"Change feed connection lost: {e!r}")
+
+            await asyncio.sleep(CHANGE_FEED_RECONNECT_DELAY)
+            # notifications sent while the connection was down are lost
+            await self.dispatch_all()
+
+    async def _listen_connection(self):
+        """Listen for notifications on one connection until it fails."""
+        loop = asyncio.get_event_loop()
+        connection = await run_db(get_db().engine.raw_connection)
+        # the driver connection, psycopg2 delivers notifications on it
+        listener = connection.connection
+        notified = asyncio.Event()
+
+        try:
+            listener.autocommit = True
+            cursor = listener.cursor()
+            cursor.execute(f"LISTEN {CHANGE_FEED_CHANNEL}")
+            loop.add_reader(listener.fileno(), notified.set)
+
+            while True:
+                try:
+                    await asyncio.wait_for(notified.wait(), CHANGE_FEED_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # raises if the server went away without closing the socket
+                    await run_db(cursor.execute, "SELECT 1")
+
+                notified.clear()
+                listener.poll()
+                while listener.notifies:
+                    change = json.loads(listener.notifies.pop(0).payload)
+                    await self.dispatch(change[TABLE_NAME_KEY], change[GUILD_ID_KEY])
+        finally:
+            try:
+                loop.remove_reader(listener.fileno())
+            except Exception:
+                pass
+            # the connection is still subscribed, it must not go back to the pool
+            connection.invalidate()
+
+
+change_feed = ChangeFeed()
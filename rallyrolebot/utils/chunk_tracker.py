@@ -0,0 +1,44 @@
+import asyncio
+
+
+class ChunkTracker:
+    """
+    Tracks which guilds have a complete member cache.
+
+    The bot is started with chunk_guilds_at_startup and the members intent, so the
+    member cache is normally kept complete by gateway events. A guild is only chunked
+    again when its cache is known to be incomplete, and concurrent requests to chunk
+    the same guild share one chunk request.
+    """
+
+    def __init__(self):
+        self.chunk_requests = 0
+        self.chunks_skipped = 0
+        self._chunking = {}
+
+    @staticmethod
+    def is_complete(guild):
+        return guild.chunked
+
+    async def ensure_chunked(self, guild):
+        """
+        Chunk a guild if its member cache is incomplete.
+
+        Parameters
+        __________
+
+          guild (discord.Guild) - The guild whose members are needed
+
+        """
+        if self.is_complete(guild):
+            self.chunks_skipped += 1
+            return
+
+        task = self._chunking.get(guild.id)
+        if task is None:
+            self.chunk_requests += 1
+            task = asyncio.ensure_future(guild.chunk())
+            self._chunking[guild.id] = task
+            task.add_done_callback(lambda _: self._chunking.pop(guild.id, None))
+
+        await asyncio.shield(task)
@@ -1,11 +1,23 @@
 import os
+import asyncio
+import logging
+import threading
 
 import functools
 
 import dataset
 import config
 
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from constants import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_THREAD_POOL_SIZE
+
+logger = logging.getLogger(__name__)
+
 db = None
+db_executor = None
+# how many connect_db calls are running in each thread, the outermost one releases
+db_calls = threading.local()
 
 
 def create_dm(cog_function):
@@ -47,41 +59,162 @@ def send_to_dm(cog_function):
     return wrapper
 
 
+def get_db():
+    """
+    Database object shared by the whole process, its engine is created on first use.
+
+    The pool size and overflow are read from POOL_SIZE and MAX_OVERFLOW once, falling
+    back to DB_POOL_SIZE and DB_MAX_OVERFLOW. Connections are checked before they're
+    handed out, so ones the server closed are replaced instead of failing a query.
+    connect_db gives a thread's connection back to the pool after every call, so the
+    pool only has to cover the calls running at the same time, not every thread.
+
+    Returns
+    _______
+
+      dataset.Database
+
+    """
+    global db
+    if db:
+        return db
+
+    try:
+        url = config.CONFIG.database_connection
+    except:
+        url = os.getenv("DATABASE_URL")
+
+    engine_kwargs = {"pool_pre_ping": True}
+    if url.startswith("sqlite"):
+        # queries run in the run_db threads, sqlite connections aren't pooled
+        engine_kwargs["connect_args"] = {"check_same_thread": False}
+    else:
+        engine_kwargs["pool_size"] = int(os.getenv("POOL_SIZE", DB_POOL_SIZE))
+        engine_kwargs["max_overflow"] = int(os.getenv("MAX_OVERFLOW", DB_MAX_OVERFLOW))
+
+    db = dataset.connect(url, engine_kwargs=engine_kwargs)
+    return db
+
+
+def release_connection(database):
+    """
+    Give the calling thread's connection back to the pool. dataset keeps one connection
+    per thread for as long as the thread lives otherwise, and the api and run_db
+    threads together are many more than the pool holds.
+
+    Parameters
+    __________
+
+      database (dataset.Database) - The database the connection belongs to
+
+    """
+    if database.in_transaction:
+        return
+
+    with database.lock:
+        connection = database.connections.pop(threading.get_ident(), None)
+    if connection is not None:
+        connection.close()
+
+
+def insert_many(database, table, rows):
+    """
+    Insert rows on the calling thread's connection. dataset's Table.insert_many runs on
+    the connection the table was loaded with instead, which can be another thread's or one
+    that's already been released.
+
+    Parameters
+    __________
+
+      database (dataset.Database) - The database the table belongs to
+      table (dataset.Table) - The table to insert into
+      rows (list) - Rows with the same keys, the first one creates missing columns
+
+    """
+    if not rows:
+        return
+
+    table.insert(rows[0])
+    if len(rows) > 1:
+        database.executable.execute(table.table.insert(), rows[1:])
+
+
 def connect_db(function):
     """
     Decorator that creates a database object and inserts as its
     the first argument in the calling function.
     Useful to prevent global objects
+
+    The thread's connection is released when the outermost call returns. Errors are
+    rolled back and turn into a None result, except running out of pooled connections,
+    which is logged and raised so it isn't mistaken for missing data.
     """
 
     @functools.wraps(function)
     def wrapper(*args, **kwargs):
         result = None
-        engine_kwargs = {}
+        database = get_db()
+        db_calls.depth = getattr(db_calls, "depth", 0) + 1
+
+        try:
+            result = function(database, *args, **kwargs)
+        except PoolTimeoutError:
+            logger.error("Database pool exhausted in %s", function.__name__)
+            database.rollback()
+            raise
+        except:
+            database.rollback()
+        finally:
+            db_calls.depth -= 1
+            if not db_calls.depth:
+                release_connection(database)
 
-        pool_size = os.getenv("POOL_SIZE")
-        max_overflow = os.getenv("MAX_OVERFLOW")
+        return result
 
-        if pool_size:
-            engine_kwargs["pool_size"] = int(pool_size)
+    return wrapper
 
-        if max_overflow:
-            engine_kwargs["max_overflow"] = int(max_overflow)
 
-        try:
-            url = config.CONFIG.database_connection
-        except:
-            url = os.getenv("DATABASE_URL")
+def get_db_executor():
+    """
+    Thread pool run_db runs in, created on first use. It never has more threads than
+    the engine pool has connections, less the one the change feed keeps listening on.
 
-        global db
-        if not db:
-            db = dataset.connect(url, engine_kwargs=engine_kwargs)
+    Returns
+    _______
 
-        try:
-            result = function(db, *args, **kwargs)
-        except:
-            db.rollback()
+      concurrent.futures.ThreadPoolExecutor
 
-        return result
+    """
+    global db_executor
+    if not db_executor:
+        connections = int(os.getenv("POOL_SIZE", DB_POOL_SIZE)) + int(
+            os.getenv("MAX_OVERFLOW", DB_MAX_OVERFLOW)
+        )
+        db_executor = ThreadPoolExecutor(
+            max_workers=max(1, min(DB_THREAD_POOL_SIZE, connections - 1)),
+            thread_name_prefix="db",
+        )
+    return db_executor
+
+
+async def run_db(function, *args, **kwargs):
+    """
+    Run a blocking database function in the database thread pool and wait for it,
+    so queries made from coroutines don't block the event loop.
 
-    return wrapper
+    Parameters
+    __________
+
+      function (callable) - The function to run, usually one of the data module functions
+      args, kwargs - Arguments the function is called with
+
+    Returns
+    _______
+
+      The return value of the function
+
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        get_db_executor(), functools.partial(function, *args, **kwargs)
+    )
@@ -0,0 +1,135 @@
+import logging
+
+from constants import *
+
+logger = logging.getLogger(__name__)
+
+"""
+    (guild id, problem, mapping) of the unresolvable mappings that were already logged.
+    A mapping is identified by its target name, coin and required balance, so an edited
+    mapping is logged again.
+"""
+reported_mappings = set()
+
+
+def report_mappings(guild, problem, mappings, name_key):
+    """
+    Log the mappings of a guild that can't be resolved, each one only the first time.
+
+    Parameters
+    __________
+
+      guild (discord.Guild) - The guild of the mappings
+      problem (str) - What's wrong with the mappings
+      mappings (list) - The unresolvable mappings
+      name_key (str) - Key of the mapped role or channel name, ROLE_NAME_KEY or CHANNEL_NAME_KEY
+
+    """
+    names = []
+    for mapping in mappings:
+        key = (
+            guild.id,
+            problem,
+            mapping[name_key],
+            mapping.get(COIN_KIND_KEY),
+            mapping.get(REQUIRED_BALANCE_KEY),
+        )
+        if key not in reported_mappings:
+            reported_mappings.add(key)
+            names.append(mapping[name_key])
+
+    if names:
+        logger.warning("%s: %s: %s", guild, problem, ", ".join(names))
+
+
+class GuildIndex:
+    """
+    Name -> object index of a guild's roles and channels.
+
+    Built once per guild per sweep so role and channel mappings are resolved once
+    instead of scanning guild.roles and guild.channels for every member.
+    Like discord.utils.get, the first role or channel with a given name wins.
+    """
+
+    def __init__(self, guild):
+        self.guild = guild
+
+        self.roles = {}
+        for role in guild.roles:
+            self.roles.setdefault(role.name, role)
+
+        self.channels = {}
+        for channel in guild.channels:
+            self.channels.setdefault(channel.name, channel)
+
+    def resolve_role_mappings(self, role_mappings):
+        """
+        Pair each role mapping with its role.
+
+        Mappings whose role doesn't exist or can't be managed by the bot are left out
+        and logged once per mapping, see report_mappings.
+
+        Parameters
+        __________
+
+          role_mappings (list) - Role mappings of the guild
+
+        Returns
+        _______
+
+          list of (role_mapping, discord.Role) tuples
+
+        """
+        resolved = []
+        missing = []
+        unmanageable = []
+        top_role = self.guild.me.top_role
+
+        for role_mapping in role_mappings:
+            role = self.roles.get(role_mapping[ROLE_NAME_KEY])
+            if role is None:
+                missing.append(role_mapping)
+            elif role.managed or role >= top_role:
+                unmanageable.append(role_mapping)
+            else:
+                resolved.append((role_mapping, role))
+
+        report_mappings(self.guild, "can't find mapped roles", missing, ROLE_NAME_KEY)
+        report_mappings(
+            self.guild, "can't manage mapped roles", unmanageable, ROLE_NAME_KEY
+        )
+
+        return resolved
+
+    def resolve_channel_mappings(self, channel_mappings):
+        """
+        Pair each channel mapping with its channel.
+
+        Mappings whose channel doesn't exist are left out and logged once per mapping, see report_mappings.
+
+        Parameters
+        __________
+
+          channel_mappings (list) - Channel mappings of the guild
+
+        Returns
+        _______
+
+          list of (channel_mapping, discord.abc.GuildChannel) tuples
+
+        """
+        resolved = []
+        missing = []
+
+        for channel_mapping in channel_mappings:
+            channel = self.channels.get(channel_mapping[CHANNEL_NAME_KEY])
+            if channel is None:
+                missing.append(channel_mapping)
+            else:
+                resolved.append((channel_mapping, channel))
+
+        report_mappings(
+            self.guild, "can't find mapped channels", missing, CHANNEL_NAME_KEY
+        )
+
+        return resolved
@@ -0,0 +1,154 @@
+import time
+
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from constants import *
+
+
+class Histogram:
+    """Latency histogram with Prometheus style cumulative buckets."""
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, observations at or below it) pairs, the last bound is +Inf."""
+        total = 0
+        bounds = [str(bucket) for bucket in self.buckets] + ["+Inf"]
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            yield bound, total
+
+
+class SweepMetrics:
+    """
+    Phase timings and call counters of the update cog.
+
+    Latencies are kept per phase (chunk, db, rally, evaluate, discord), calls and
+    errors per service and guild. Everything is cumulative since the bot started,
+    the numbers of the last finished sweep are kept separately in last_sweep.
+    """
+
+    def __init__(self):
+        self.phases = defaultdict(Histogram)
+        self.calls = Counter()
+        self.errors = Counter()
+        self.last_sweep = {}
+        self.last_sweep_time = None
+
+    @contextmanager
+    def timer(self, phase):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[phase].observe(time.monotonic() - start)
+
+    def count(self, service, guild_id=None, calls=1, errors=0):
+        """
+        Count calls made to a service.
+
+        Parameters
+        __________
+
+          service (str) - METRICS_SERVICE_RALLY, METRICS_SERVICE_DISCORD or METRICS_SERVICE_DB
+          guild_id (int) - Guild the calls were made for, None if they weren't made for a single guild
+          calls (int) - Number of calls
+          errors (int) - How many of the calls failed
+
+        """
+        self.calls[(service, guild_id)] += calls
+        if errors:
+            self.errors[(service, guild_id)] += errors
+
+    @contextmanager
+    def db_call(self, guild_id=None):
+        """Time and count a database call, counting it as an error if it raises."""
+        failed = 0
+        try:
+            with self.timer(METRICS_PHASE_DB):
+                yield
+        except Exception:
+            failed = 1
+            raise
+        finally:
+            self.count(METRICS_SERVICE_DB, guild_id, errors=failed)
+
+    def finish_sweep(self, stats, duration):
+        """
+        Record the summary of a finished sweep.
+
+        Parameters
+        __________
+
+          stats (collections.Counter) - The counters of the sweep
+          duration (float) - Seconds the sweep took
+
+        """
+        self.phases[METRICS_PHASE_SWEEP].observe(duration)
+        self.last_sweep = dict(stats)
+        self.last_sweep_time = duration
+
+    def totals(self, service):
+        """Calls and errors of a service summed over all guilds."""
+        calls = sum(n for (s, _), n in self.calls.items() if s == service)
+        errors = sum(n for (s, _), n in self.errors.items() if s == service)
+        return calls, errors
+
+    def render(self):
+        """
+        Render the metrics in the Prometheus text exposition format.
+
+        Returns
+        _______
+
+          str
+
+        """
+        lines = []
+
+        name = f"{METRICS_PREFIX}_phase_seconds"
+        lines.append(f"# HELP {name} Time spent in each phase of the role update.")
+        lines.append(f"# TYPE {name} histogram")
+        for phase, histogram in sorted(self.phases.items()):
+            for bound, count in histogram.cumulative():
+                lines.append(f'{name}_bucket{{phase="{phase}",le="{bound}"}} {count}')
+            lines.append(f'{name}_sum{{phase="{phase}"}} {histogram.sum}')
+            lines.append(f'{name}_count{{phase="{phase}"}} {histogram.count}')
+
+        for counter, kind, description in (
+            (self.calls, "calls", "Calls made to a service."),
+            (self.errors, "errors", "Failed calls to a service."),
+        ):
+            name = f"{METRICS_PREFIX}_{kind}_total"
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            for (service, guild_id), count in sorted(
+                counter.items(), key=lambda item: (item[0][0], str(item[0][1]))
+            ):
+                labels = f'service="{service}"'
+                if guild_id is not None:
+                    labels += f',guild="{guild_id}"'
+                lines.append(f"{name}{{{labels}}} {count}")
+
+        name = f"{METRICS_PREFIX}_last_sweep"
+        lines.append(f"# HELP {name} Counters of the last finished sweep.")
+        lines.append(f"# TYPE {name} gauge")
+        for stat, value in sorted(self.last_sweep.items()):
+            lines.append(f'{name}{{stat="{stat}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+
+sweep_metrics = SweepMetrics()
@@ -0,0 +1,48 @@
+import data
+
+from utils.ext import run_db
+
+
+class PrefixCache:
+    """
+    In memory guild id -> command prefix map used to resolve the prefix of every message.
+
+    The whole channel_prefixes table is loaded in one query at startup, after that the
+    cache is kept current by set() whenever the bot changes a prefix and by refresh()
+    when the change feed reports the api changed one, so resolving a message's prefix
+    never queries the database. A miss is a guild without a custom
+    prefix, it uses the default one.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._prefixes = {}
+
+    def warm(self):
+        """Load every guild's prefix, replacing the cached ones."""
+        self._prefixes = data.get_all_prefixes() or {}
+
+    async def refresh(self, guild_id):
+        """Reload a guild's prefix from the database, every guild's if guild_id is None."""
+        if guild_id is None:
+            await run_db(self.warm)
+        else:
+            self.set(guild_id, await run_db(data.get_prefix, guild_id))
+
+    def get(self, guild_id):
+        prefix = self._prefixes.get(int(guild_id))
+        if prefix is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return prefix
+
+    def set(self, guild_id, prefix):
+        if prefix:
+            self._prefixes[int(guild_id)] = prefix
+        else:
+            self._prefixes.pop(int(guild_id), None)
+
+
+prefix_cache = PrefixCache()
@@ -0,0 +1,38 @@
+import datetime
+import time
+import data
+
+from constants import *
+
+
+def prune_coin_prices(retention_days, overrides=PRICE_RETENTION_OVERRIDES):
+    """
+    Delete the coin prices that are older than their coin's retention.
+
+    Each coin keeps its own history for a time, so a coin with many prices can't push
+    out another coin's. Every retention is enforced with a single delete statement.
+
+    Parameters
+    __________
+
+      retention_days (float) - Days the prices of coins without an override are kept
+      overrides (dict) - coin symbol -> days its prices are kept
+
+    Returns
+    _______
+
+      (rows removed, seconds taken) tuple
+
+    """
+    start = time.monotonic()
+    now = datetime.datetime.now()
+
+    removed = data.delete_old_coin_prices(
+        now - datetime.timedelta(days=retention_days), exclude=list(overrides)
+    )
+    for coin, days in overrides.items():
+        removed += data.delete_old_coin_prices(
+            now - datetime.timedelta(days=days), coin=coin
+        )
+
+    return removed, time.monotonic() - start
@@ -0,0 +1,131 @@
+import asyncio
+import time
+import data
+
+from collections import defaultdict
+from constants import *
+from utils import tasks
+from utils.change_feed import change_feed
+from utils.ext import run_db
+from utils.metrics import Histogram
+
+
+class TaskQueue:
+    """
+    Runs the tasks the api process adds to the tasks table, see utils.tasks.
+
+    Tasks are claimed in batches of TASK_QUEUE_BATCH_SIZE. The queue sleeps until the
+    change feed reports a new task, checking anyway every TASK_QUEUE_IDLE_POLL seconds.
+    A task that raises is retried after TASK_RETRY_BACKOFF seconds, doubled for every
+    further attempt. After TASK_MAX_ATTEMPTS runs it's moved to the dead letter table.
+    """
+
+    def __init__(self):
+        self.executed = 0
+        self.retried = 0
+        self.dead = 0
+        self.wait_times = defaultdict(Histogram)
+        self.run_times = defaultdict(Histogram)
+        self._wakeup = None
+        self._task = None
+
+    def start(self):
+        if self._task:
+            return
+        self._wakeup = asyncio.Event()
+        change_feed.subscribe(TASKS_TABLE, self.wake)
+        self._task = asyncio.ensure_future(self._run())
+
+    async def wake(self, _=None):
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            # cleared before claiming, a task added during the claim wakes the next wait
+            self._wakeup.clear()
+            claimed = await run_db(
+                data.claim_tasks, TASK_QUEUE_BATCH_SIZE, TASK_LEASE_TIME
+            )
+            if claimed:
+                await asyncio.gather(*[self._execute(task) for task in claimed])
+                continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), TASK_QUEUE_IDLE_POLL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, task):
+        name = task["function"]
+        start = time.time()
+        if task.get(TIME_ADDED_KEY):
+            self.wait_times[name].observe(start - task[TIME_ADDED_KEY])
+
+        task_function = getattr(tasks, name, None)
+        try:
+            if task_function is None:
+                raise AttributeError(f"unknown task function {name}")
+            await task_function(**(task["kwargs"] or {}))
+        except Exception as e:
+            # a task naming a function that doesn't exist can't succeed on a retry
+            await self._fail(task, e, retry=task_function is not None)
+        else:
+            self.executed += 1
+            await run_db(data.delete_task, task["id"])
+        finally:
+            self.run_times[name].observe(time.time() - start)
+
+    async def _fail(self, task, error, retry=True):
+        attempts = (task.get(ATTEMPTS_KEY) or 0) + 1
+        if not retry or attempts >= TASK_MAX_ATTEMPTS:
+            self.dead += 1
+            print(f"Task {task['function']} failed {attempts} times, giving up: {error!r}")
+            await run_db(data.fail_task, task, repr(error), None)
+            return
+
+        self.retried += 1
+        retry_in = TASK_RETRY_BACKOFF * 2 ** (attempts - 1)
+        await run_db(data.fail_task, task, repr(error), retry_in)
+        asyncio.get_event_loop().call_later(retry_in, self._wakeup.set)
+
+    def render(self):
+        """
+        Render the task latencies and counters in the Prometheus text exposition format.
+
+        Returns
+        _______
+
+          str
+
+        """
+        lines = []
+
+        for histograms, kind, description in (
+            (self.wait_times, "wait", "Time tasks waited before they were run."),
+            (self.run_times, "run", "Time tasks took to run."),
+        ):
+            name = f"{METRICS_PREFIX}_task_{kind}_seconds"
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} histogram")
+            for function, histogram in sorted(histograms.items()):
+                for bound, count in histogram.cumulative():
+                    lines.append(
+                        f'{name}_bucket{{function="{function}",le="{bound}"}} {count}'
+                    )
+                lines.append(f'{name}_sum{{function="{function}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{function="{function}"}} {histogram.count}')
+
+        name = f"{METRICS_PREFIX}_tasks_total"
+        lines.append(f"# HELP {name} Task runs by outcome.")
+        lines.append(f"# TYPE {name} counter")
+        for outcome, count in (
+            ("executed", self.executed),
+            ("retried", self.retried),
+            ("dead", self.dead),
+        ):
+            lines.append(f'{name}{{outcome="{outcome}"}} {count}')
+
+        return "\n".join(lines) + "\n"
+
+
+task_queue = TaskQueue()
@@ -9,6 +9,7 @@ import os
 import main
 
 from cogs import update_cog
+from utils.ext import run_db
 from constants import *
 from asyncio import ensure_future
 from functools import wraps
@@ -114,11 +115,11 @@ async def update_avatar(guild_id: int, bot_id: int, new_avatar_path: str):
     try:
         bot_object = main.running_bots[bot_id]['bot']
         await bot_object.user.edit(avatar=new_avatar)
-        data.set_bot_avatar(guild_id, str(bot_object.user.avatar_url))
+        await run_db(data.set_bot_avatar, guild_id, str(bot_object.user.avatar_url))
     except discord.HTTPException:
         # user is editing avatar too many times, set 1h timeout
         timout = round(time.time() + 3600)
-        data.set_avatar_timout(guild_id, timout)
+        await run_db(data.set_avatar_timout, guild_id, timout)
     except:
         pass
 
@@ -155,7 +156,9 @@ async def update_activity(guild_id: int, bot_id: int, activity_type_str: str, ac
                 new_activity = discord.Activity(type=activity_type, name=activity_text)
                 main.running_bots[bot_id]['activity'] = new_activity
                 await bot_object.change_presence(status=discord.Status.online, activity=new_activity)
-                data.set_activity(guild_id, activity_type_str, activity_text)
+                await run_db(
+                    data.set_activity, guild_id, activity_type_str, activity_text
+                )
         except:
             pass
 
@@ -170,7 +173,7 @@ async def start_daily_stats_timers(guild_id: int, timezone, channel: str):
     @param channel: name of channel where message will be sent
     """
     # get bot instance, if it isn't set, assume the bot being used is the main one
-    bot_instance = data.get_bot_instance(guild_id)
+    bot_instance = await run_db(data.get_bot_instance, guild_id)
     bot_object = main.main_bot if not bot_instance else main.running_bots[bot_instance[BOT_ID_KEY]]['bot']
 
     try:
@@ -202,7 +205,7 @@ async def start_daily_stats_timers(guild_id: int, timezone, channel: str):
     time_midnight = time.time() + (((24 - dt.hour - 1) * 60 * 60) + ((60 - dt.minute - 1) * 60) + (60 - dt.second))
 
     # start new timer for instance
-    bot_object.timers.create(
+    await bot_object.timers.create(
         guild_id=guild_id,
         expires=time_midnight,
         event='daily_stats',
@@ -239,15 +242,26 @@ async def update_name(guild_id: int, bot_id: int, new_name: str):
     try:
         if new_name != bot_object.user.name:
             await bot_object.user.edit(username=new_name)
-            data.set_bot_name(guild_id, new_name)
+            await run_db(data.set_bot_name, guild_id, new_name)
     except discord.HTTPException:
         # user is editing name too many times, set 1h timeout
         timout = round(time.time() + 3600)
-        data.set_name_timeout(guild_id, timout)
+        await run_db(data.set_name_timeout, guild_id, timout)
     except:
         pass
 
 
+async def refresh_guild(guild_id: int, scope: str):
+    """
+    Queue a targeted update of a guild after its mappings were changed through the api.
+
+    @param guild_id: id of guild
+    @param scope: which mappings changed, UPDATE_SCOPE_ROLES or UPDATE_SCOPE_CHANNELS
+    """
+    # the update queue is shared by every bot instance, the engine routes the update to the guild's owner
+    main.main_bot.get_cog('UpdateTask').queue_update(guild_id, scope=scope)
+
+
 async def delete_bot_instance(guild_id: int):
     """
     Delete a bot instance and stop it
@@ -255,9 +269,9 @@ async def delete_bot_instance(guild_id: int):
     @param guild_id: id of guild
     """
 
-    bot_instance = data.get_bot_instance(guild_id)
+    bot_instance = await run_db(data.get_bot_instance, guild_id)
     try:
-        data.remove_bot_instance(guild_id)
+        await run_db(data.remove_bot_instance, guild_id)
         main.running_bot_instances.remove(bot_instance[BOT_TOKEN_KEY])
         to_be_removed = main.running_bots[bot_instance[BOT_ID_KEY]]
         if to_be_removed:
@@ -0,0 +1,234 @@
+from bisect import bisect_right
+from collections import defaultdict
+
+from constants import *
+
+try:
+    import numpy
+except ImportError:
+    # numpy is optional, without it every guild is evaluated one member at a time
+    numpy = None
+
+
+def parse_balances(balances):
+    """
+    Convert a rally balances list into a coin -> amount dict.
+
+    Parameters
+    __________
+
+      balances (list) - Balances as returned by the rally api
+
+    """
+    if not balances:
+        return {}
+    return {
+        balance[COIN_KIND_KEY]: float(balance[COIN_BALANCE_KEY])
+        for balance in balances
+    }
+
+
+def use_vectorized(member_count):
+    """Whether this many members should be evaluated with the numpy methods of ThresholdIndex."""
+    return (
+        numpy is not None
+        and VECTORIZE_MIN_MEMBERS is not None
+        and member_count >= VECTORIZE_MIN_MEMBERS
+    )
+
+
+class ThresholdIndex:
+    """
+    Role or channel mappings of a guild compiled into a sorted threshold array per coin.
+
+    Finding the mappings a member qualifies for is a bisect per mapped coin,
+    so a guild with dozens of mappings costs about the same as one with a single mapping.
+    With tiered set, only the highest mapping a member qualifies for is granted per coin.
+    """
+
+    def __init__(self, mappings, tiered=False):
+        """
+        Parameters
+        __________
+
+          mappings (list) - (mapping, target) tuples, as returned by GuildIndex.resolve_*_mappings
+          tiered (bool) - Only grant the highest qualifying target of each coin
+
+        """
+        self.tiered = tiered
+        self.targets = set()
+        self.thresholds = {}
+        self._targets_by_coin = {}
+
+        by_coin = defaultdict(list)
+        for mapping, target in mappings:
+            by_coin[mapping[COIN_KIND_KEY]].append(
+                (float(mapping[REQUIRED_BALANCE_KEY]), target)
+            )
+            self.targets.add(target)
+
+        for coin, entries in by_coin.items():
+            entries.sort(key=lambda entry: entry[0])
+            self.thresholds[coin] = [required for required, _ in entries]
+            self._targets_by_coin[coin] = [target for _, target in entries]
+
+    def __len__(self):
+        return len(self.targets)
+
+    def crossed(self, old_amounts, new_amounts):
+        """
+        Check whether a member's holdings moved across any threshold of a mapped coin.
+
+        Parameters
+        __________
+
+          old_amounts (dict) - coin -> amount the member held before
+          new_amounts (dict) - coin -> amount the member holds now
+
+        """
+        for coin, thresholds in self.thresholds.items():
+            if bisect_right(thresholds, old_amounts.get(coin, 0.0)) != bisect_right(
+                thresholds, new_amounts.get(coin, 0.0)
+            ):
+                return True
+        return False
+
+    def qualifying(self, amounts):
+        """
+        Get the targets a member qualifies for.
+
+        Parameters
+        __________
+
+          amounts (dict) - coin -> amount, as returned by parse_balances
+
+        Returns
+        _______
+
+          set of targets
+
+        """
+        qualifying = set()
+        for coin, thresholds in self.thresholds.items():
+            count = bisect_right(thresholds, amounts.get(coin, 0.0))
+            if not count:
+                continue
+
+            targets = self._targets_by_coin[coin]
+            if self.tiered:
+                qualifying.add(targets[count - 1])
+            else:
+                qualifying.update(targets[:count])
+
+        return qualifying
+
+    def qualifying_matrix(self, amounts_list):
+        """
+        Vectorized counterpart of qualifying for many members at once, needs numpy.
+
+        Parameters
+        __________
+
+          amounts_list (list) - coin -> amount dict of each member
+
+        Returns
+        _______
+
+          (targets, matrix) tuple, matrix[i, j] is True if member i qualifies for targets[j]
+
+        """
+        targets = list(self.targets)
+        columns = {target: column for column, target in enumerate(targets)}
+        matrix = numpy.zeros((len(amounts_list), len(targets)), dtype=bool)
+
+        for coin, thresholds in self.thresholds.items():
+            amounts = numpy.fromiter(
+                (amounts.get(coin, 0.0) for amounts in amounts_list),
+                dtype=float,
+                count=len(amounts_list),
+            )
+            # number of thresholds each member reaches, like bisect_right
+            counts = numpy.searchsorted(thresholds, amounts, side="right")
+            for position, target in enumerate(self._targets_by_coin[coin]):
+                if self.tiered:
+                    matrix[:, columns[target]] |= counts == position + 1
+                else:
+                    matrix[:, columns[target]] |= counts > position
+
+        return targets, matrix
+
+    def changes(self, amounts_list, current_list):
+        """
+        Compare the targets members qualify for with the ones they have, in one vectorized pass.
+
+        Targets are matched by id, current_list may hold anything with an id, like member.roles.
+
+        Parameters
+        __________
+
+          amounts_list (list) - coin -> amount dict of each member
+          current_list (list) - Targets each member has now, unmapped ones are ignored
+
+        Returns
+        _______
+
+          dict of member position -> set of targets to add or remove, only for the members
+          whose mapped targets differ from the ones they qualify for
+
+        """
+        targets, should = self.qualifying_matrix(amounts_list)
+        if not targets:
+            return {}
+
+        target_ids = numpy.array([target.id for target in targets], dtype=numpy.int64)
+        order = numpy.argsort(target_ids)
+        sorted_ids = target_ids[order]
+
+        # flatten every member's targets into (row, id) pairs and keep the mapped ones
+        lengths = numpy.fromiter(
+            (len(current) for current in current_list),
+            dtype=numpy.int64,
+            count=len(current_list),
+        )
+        held_ids = numpy.fromiter(
+            (target.id for current in current_list for target in current),
+            dtype=numpy.int64,
+            count=int(lengths.sum()),
+        )
+        held_rows = numpy.repeat(numpy.arange(len(current_list)), lengths)
+        positions = numpy.minimum(
+            numpy.searchsorted(sorted_ids, held_ids), len(sorted_ids) - 1
+        )
+        mapped = sorted_ids[positions] == held_ids
+
+        has = numpy.zeros_like(should)
+        has[held_rows[mapped], order[positions[mapped]]] = True
+
+        differs = should != has
+        rows = numpy.flatnonzero(differs.any(axis=1))
+        if not len(rows):
+            return {}
+
+        # members mostly differ in the same few ways, so each distinct pattern becomes a set once.
+        # Rows are packed into 64 bit words first, sorting a single word column is much faster.
+        packed = numpy.packbits(differs[rows], axis=1)
+        words = -packed.shape[1] % 8
+        packed = numpy.pad(packed, ((0, 0), (0, words))).view(numpy.uint64)
+        if packed.shape[1] == 1:
+            _, first, inverse = numpy.unique(
+                packed[:, 0], return_index=True, return_inverse=True
+            )
+        else:
+            _, first, inverse = numpy.unique(
+                packed, axis=0, return_index=True, return_inverse=True
+            )
+        pattern_targets = [
+            frozenset(targets[column] for column in numpy.flatnonzero(differs[rows[row]]))
+            for row in first.tolist()
+        ]
+        return dict(
+            zip(
+                rows.tolist(),
+                [pattern_targets[index] for index in inverse.ravel().tolist()],
+            )
+        )
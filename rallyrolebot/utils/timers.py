@@ -2,17 +2,19 @@ import time
 import data
 import asyncio
 
+from utils.ext import run_db
+
 
 class Timers:
     def __init__(self, bot):
         self.bot = bot
 
-    def run_old(self):
+    async def run_old(self):
         """Starts up old timers that weren't finished when the bot was closed."""
 
         print('running old timers')
         # get all the timers attached to a self.bot and run them
-        timers = data.get_all_timers(self.bot.user.id)
+        timers = await run_db(data.get_all_timers, self.bot.user.id)
         for timer in timers:
             asyncio.create_task(self.run(timer))
 
@@ -29,26 +31,26 @@ class Timers:
             await asyncio.sleep(int(timer['expires'] - now))
 
         # call timer event when timer is finished
-        self.call_event(timer)
+        await self.call_event(timer)
 
-    def call_event(self, timer):
+    async def call_event(self, timer):
         """
         Call provided timer event.
 
         @param timer: Timer object dict
         """
         # check if timer has been deleted, if it hasn't call provided event
-        timer = data.get_timer(timer['id'])
+        timer = await run_db(data.get_timer, timer['id'])
         if not timer:
             return
 
         # delete timer
-        data.delete_timer(timer['id'])
+        await run_db(data.delete_timer, timer['id'])
 
         # dispatch event
         self.bot.dispatch(f'{timer["event"]}_timer_over', timer)
 
-    def create(self, *, guild_id: int, expires: int, event: str, extras: dict, bot_id: int) -> None:
+    async def create(self, *, guild_id: int, expires: int, event: str, extras: dict, bot_id: int) -> None:
         """
         Create a new timer to run in the background, slowly ticking away, until its time to strike.
 
@@ -67,6 +69,6 @@ class Timers:
             'bot_id': bot_id
         }
 
-        timer_id = data.add_timer(timer)
+        timer_id = await run_db(data.add_timer, timer)
         timer['id'] = timer_id
         asyncio.create_task(self.run(timer))
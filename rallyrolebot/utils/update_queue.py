@@ -0,0 +1,50 @@
+import asyncio
+
+from collections import namedtuple
+
+from constants import *
+
+"""
+    A targeted update. guild_id None means every guild the member is in,
+    member_id None means every linked member of the guild.
+    scope is one of UPDATE_SCOPE_ALL, UPDATE_SCOPE_ROLES or UPDATE_SCOPE_CHANNELS.
+"""
+UpdateItem = namedtuple("UpdateItem", ["guild_id", "member_id", "scope"])
+
+
+class UpdateQueue:
+    """
+    Queue of targeted updates waiting to be processed by the update cog.
+
+    Queuing an item that is already pending, or that is covered by a pending
+    update of the whole guild, is a no-op.
+    """
+
+    def __init__(self):
+        self._queue = asyncio.Queue()
+        self._pending = set()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _is_covered(self, item):
+        if item in self._pending:
+            return True
+        if item.guild_id is None:
+            return False
+
+        for scope in {item.scope, UPDATE_SCOPE_ALL}:
+            if UpdateItem(item.guild_id, None, scope) in self._pending:
+                return True
+        return False
+
+    def put(self, item):
+        if self._is_covered(item):
+            return
+        self._pending.add(item)
+        self._queue.put_nowait(item)
+
+    async def get(self):
+        item = await self._queue.get()
+        self._pending.discard(item)
+        return item
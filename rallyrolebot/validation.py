@@ -4,6 +4,8 @@ from discord.utils import get
 import errors
 import data
 
+from utils.ext import run_db
+
 
 def owner_or_permissions(**perms):
     """
@@ -60,7 +62,7 @@ async def is_valid_channel(ctx, channel_name):
 
 def is_wallet_verified():
     async def extended_check(ctx):
-        rally_id = data.get_rally_id(ctx.message.author.id)
+        rally_id = await run_db(data.get_rally_id, ctx.message.author.id)
         if rally_id is None:
             raise errors.WalletNotVerified(
                 ctx.message.author.mention
@@ -0,0 +1,78 @@
+import threading
+import types
+
+import dataset
+import pytest
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+import config
+import data
+from utils import ext
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    monkeypatch.setattr(config, "CONFIG", types.SimpleNamespace(database_connection=url))
+    # a pool with a single connection, so holding it starves every other caller
+    database = dataset.connect(
+        url,
+        engine_kwargs={
+            "poolclass": QueuePool,
+            "pool_size": 1,
+            "max_overflow": 0,
+            "pool_timeout": 0.1,
+            "connect_args": {"check_same_thread": False},
+        },
+    )
+    monkeypatch.setattr(ext, "db", database)
+    yield database
+    database.close()
+
+
+def run_in_thread(function, *args):
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = function(*args)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    return outcome
+
+
+def test_connections_are_released_after_each_call(db):
+    data.add_prefix_mapping(1, "?")
+
+    # every thread gets the single pooled connection, none of them keeps it
+    for _ in range(3):
+        assert run_in_thread(data.get_prefix, 1) == {"result": "?"}
+    assert db.connections == {}
+
+
+def test_connection_is_kept_inside_a_transaction(db):
+    data.add_prefix_mapping(1, "?")
+
+    with db:
+        assert data.get_prefix(1) == "?"
+        assert threading.get_ident() in db.connections
+    assert data.get_prefix(1) == "?"
+
+
+def test_pool_exhaustion_is_raised(db):
+    data.add_prefix_mapping(1, "?")
+    held = db.engine.connect()
+
+    try:
+        outcome = run_in_thread(data.get_prefix, 1)
+    finally:
+        held.close()
+
+    assert isinstance(outcome.get("error"), PoolTimeoutError)
+    assert run_in_thread(data.get_prefix, 1) == {"result": "?"}
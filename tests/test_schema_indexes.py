@@ -0,0 +1,74 @@
+import types
+
+import pytest
+
+from sqlalchemy.exc import IntegrityError
+
+import config
+import data
+from constants import *
+from utils import ext
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        config,
+        "CONFIG",
+        types.SimpleNamespace(database_connection=f"sqlite:///{tmp_path / 'test.db'}"),
+    )
+    monkeypatch.setattr(ext, "db", None)
+    yield ext.get_db()
+    ext.db.executable.close()
+
+
+def populate():
+    # upsert creates a plain index on its keys, before migrate has run
+    data.add_role_coin_mapping(1, "COIN", 10, "holder")
+    data.add_discord_rally_mapping(2, "rally-2")
+    data.set_balance_snapshots({(1, "rally-2"): {"COIN": 1.0}})
+    data.add_event("buy", "COIN", 1.0)
+
+
+def test_declared_unique_indexes_are_unique(db):
+    populate()
+    data.migrate()
+
+    for indexes in data.SCHEMA_INDEXES.values():
+        for table_name, columns, unique in indexes:
+            if table_name not in db:
+                continue
+            index = data.find_index(db, table_name, columns)
+            assert index is not None, (table_name, columns)
+            if unique:
+                assert index["unique"], (table_name, columns)
+
+
+def test_covered_columns_get_their_own_index(db):
+    populate()
+    data.migrate()
+
+    # (event, coinKind, timeAdded) starts with other columns and doesn't cover timeAdded alone
+    assert data.find_index(db, EVENTS_TABLE, [TIME_ADDED_KEY]) is not None
+
+
+def test_unique_index_rejects_duplicates(db):
+    populate()
+    data.migrate()
+
+    with pytest.raises(IntegrityError):
+        db[RALLY_CONNECTIONS_TABLE].insert({DISCORD_ID_KEY: 2, RALLY_ID_KEY: "other"})
+
+
+def test_plain_index_is_replaced_on_an_applied_version(db):
+    populate()
+    data.migrate()
+
+    table = db[RALLY_CONNECTIONS_TABLE]
+    index = data.find_index(db, RALLY_CONNECTIONS_TABLE, [DISCORD_ID_KEY])
+    db.executable.execute(f'DROP INDEX "{index["name"]}"')
+    table.create_index([DISCORD_ID_KEY])
+    assert not data.find_index(db, RALLY_CONNECTIONS_TABLE, [DISCORD_ID_KEY])["unique"]
+
+    assert data.create_index(db, RALLY_CONNECTIONS_TABLE, [DISCORD_ID_KEY], True)
+    assert data.find_index(db, RALLY_CONNECTIONS_TABLE, [DISCORD_ID_KEY])["unique"]